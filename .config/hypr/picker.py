@@ -1,15 +1,45 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+from __future__ import annotations
 
 import os
 import sys
+import json
+import math
+import time
+import select
+import stat
+import heapq
+import struct
+import hashlib
+import threading
 import subprocess
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Tuple, Optional
-from concurrent.futures import ThreadPoolExecutor, Future
+from typing import TYPE_CHECKING, Iterator, List, Tuple, Optional
+from concurrent.futures import Future
+
+from PIL import Image
+
+if TYPE_CHECKING:  # annotations only; both are imported lazily below
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+
+# Startup matters (the picker sits on a hotkey), so modules that only some
+# paths need are imported where they are used: multiprocessing and the
+# process pool, ctypes (watch mode), argparse (subcommands), ImageSequence.
+# tkinter and ImageTk are only imported for the GUI (see load_gui) so the
+# CLI subcommands start without them
+tk = None
+ImageTk = None
+
+
+def load_gui():
+    global tk, ImageTk
+    import tkinter as tk
+    from PIL import ImageTk
 
-import tkinter as tk
-from PIL import Image, ImageTk, ImageSequence
 
 # Theme
 COL_BG = "#1f1f1f"
@@ -26,6 +56,82 @@ LAST_FILE = os.environ.get(
 SUPPORTED_EXT = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
 THUMB_SIZE: Tuple[int, int] = (360, 203)
 COLUMNS = int(os.environ.get("COLUMNS", "4"))
+CACHE_DIR = os.environ.get(
+    "PICKER_CACHE_DIR", str(Path.home() / ".cache" / "wallpaper-picker")
+)
+# Upper bound for the on-disk thumbnail cache, oldest entries evicted first
+THUMB_CACHE_MB = int(os.environ.get("THUMB_CACHE_MB", "256"))
+THUMB_CACHE_QUALITY = 85
+# Packed thumbnail atlas: every THUMB_SIZE thumbnail as raw RGB in one
+# mmap'd file, so warm tiles need neither a file open nor a decode; the
+# JPEG cache above stays as the second tier. Raw slots cost about 220 KB a
+# wallpaper on disk (roughly 15x the JPEG), 2.2 GB for 10k files. By
+# default it grows with the library; ATLAS_MB > 0 caps it, least recently
+# used slots reused first and `warm` filling only the top of the grid.
+# PICKER_ATLAS=0 turns it off.
+ATLAS = os.environ.get("PICKER_ATLAS", "1") == "1"
+ATLAS_MB = int(os.environ.get("ATLAS_MB", "0"))
+ATLAS_SAVE_S = 2
+# Opt-in instrumentation: PICKER_PROFILE=1 writes a Chrome trace to
+# CACHE_DIR/trace-<pid>.json on close (any other value is used as the path)
+# and prints a per-stage summary to stderr
+PROFILE = os.environ.get("PICKER_PROFILE", "")
+STALL_TICK_MS = 20
+STALL_MS = 50
+# Pre-render cover-cropped copies of wallpapers at each monitor's resolution
+# so `swww img` gets a file it does not have to scale; recently used and
+# favourite (FAVORITES_FILE, one path per line) wallpapers are rendered in
+# the background
+PRERENDER = os.environ.get("PRERENDER", "0") == "1"
+VARIANT_CACHE_MB = int(os.environ.get("VARIANT_CACHE_MB", "2048"))
+FAVORITES_FILE = os.environ.get(
+    "FAVORITES_FILE", str(Path.home() / ".config" / "hypr" / "favorites")
+)
+HISTORY_LEN = 20
+# Perceptual hashes and dominant colours (FeatureIndex). Files whose hashes
+# are within DUP_DISTANCE bits are collapsed into one tile when DEDUP is on
+# (PICKER_DEDUP=1); search still matches every file by name.
+# numpy is optional: without it a Pillow-only difference hash is used.
+DEDUP = os.environ.get("PICKER_DEDUP", "0") == "1"
+DUP_DISTANCE = int(os.environ.get("PICKER_DUP_DISTANCE", "6"))
+FEATURE_BATCH = 64
+# Watch WALL_DIR with inotify and update the open grid as files come and go
+WATCH = os.environ.get("PICKER_WATCH", "0") == "1"
+# Memory budget for decoded animation frames held by the running picker
+ANIM_CACHE_MB = int(os.environ.get("ANIM_CACHE_MB", "512"))
+# Previews stream frames: decode this many ahead of the playhead, and only
+# keep a sliding window (re-seeking each loop) for animations larger than
+# STREAM_FULL_MB once decoded
+STREAM_AHEAD = int(os.environ.get("STREAM_AHEAD", "8"))
+STREAM_FULL_MB = int(os.environ.get("STREAM_FULL_MB", "96"))
+STREAM_POLL_MS = 15
+# Preview frames are decoded at the preview box rounded up to a multiple of
+# PREVIEW_BUCKET px and centre-cropped by the label, so a resized window
+# still hits the cache. Previews are decoded ahead of the click for a tile
+# hovered for HOVER_PREFETCH_MS and for animated tiles where scrolling will
+# land SCROLL_PREDICT_S from now; at most PREVIEW_PREFETCH guesses are
+# outstanding, the oldest dropped first.
+PREVIEW_BUCKET = int(os.environ.get("PREVIEW_BUCKET", "160"))
+PREVIEW_PREFETCH = int(os.environ.get("PREVIEW_PREFETCH", "3"))
+HOVER_PREFETCH_MS = 60
+SCROLL_PREDICT_MS = 100
+SCROLL_PREDICT_S = 0.3
+# All animations are driven by one timer running at ANIM_FPS; at most
+# ANIM_MAX_UPDATES image swaps happen per tick, the rest wait for the next one
+ANIM_FPS = int(os.environ.get("ANIM_FPS", "60"))
+ANIM_MAX_UPDATES = int(os.environ.get("ANIM_MAX_UPDATES", "32"))
+# Adaptive quality: when the animation tick's cost plus lateness (smoothed)
+# exceeds QUALITY_BUSY_MS, step down one level: thumbnail animations capped
+# to each of QUALITY_TILE_FPS in turn, then only the hovered tile animates,
+# with speculative prefetch cut to one worker from the first step. Below
+# QUALITY_IDLE_MS for QUALITY_RESTORE_S, step back up.
+ADAPTIVE = os.environ.get("PICKER_ADAPTIVE", "1") == "1"
+QUALITY_BUSY_MS = float(os.environ.get("QUALITY_BUSY_MS", "12"))
+QUALITY_IDLE_MS = float(os.environ.get("QUALITY_IDLE_MS", "4"))
+QUALITY_RESTORE_S = float(os.environ.get("QUALITY_RESTORE_S", "2"))
+QUALITY_TILE_FPS = [
+    float(v) for v in os.environ.get("QUALITY_TILE_FPS", "15,6").split(",") if v
+]
 SWWW_ARGS = [
     "--transition-type",
     os.environ.get("SWWW_TRANSITION", "random"),
@@ -34,212 +140,3098 @@ SWWW_ARGS = [
     "--transition-fps",
     os.environ.get("SWWW_FPS", "144"),
 ]
+# Seconds before a hung swww command is killed and reported as failed
+SWWW_TIMEOUT = float(os.environ.get("SWWW_TIMEOUT", "10"))
+# Optional cache service (`picker.py serve`): one long-lived process owns the
+# library index and decodes thumbnails and animations once, as raw buffers
+# in SHARED_DIR (tmpfs) that pickers and scripts map instead of decoding.
+# Without it everything is decoded in-process. SHARED_CACHE_MB bounds
+# SHARED_DIR; after a failed request the service is not tried for
+# SERVICE_RETRY_S. The service only builds THUMB_SIZE thumbnails and
+# animations at THUMB_SIZE or the preview bucket of a box up to
+# SHARED_MAX_PREVIEW, and only animations that fit STREAM_FULL_MB whole;
+# other requests are refused. The socket and buffers are only used from
+# directories private to this user (the /tmp fallback is a guessable path).
+_RUNTIME_DIR = (os.environ.get("XDG_RUNTIME_DIR")
+                or f"/tmp/wallpaper-picker-{os.getuid()}")
+CACHE_SOCKET = os.environ.get(
+    "PICKER_SOCKET", os.path.join(_RUNTIME_DIR, "wallpaper-picker.sock"))
+SHARED_DIR = os.environ.get(
+    "PICKER_SHARED_DIR", os.path.join(_RUNTIME_DIR, "wallpaper-picker"))
+SHARED_CACHE_MB = int(os.environ.get("SHARED_CACHE_MB", "512"))
+SHARED_MAX_PREVIEW = tuple(
+    int(v) for v in os.environ.get("SHARED_MAX_PREVIEW", "3840x2160").split("x"))
+SERVICE_TIMEOUT = 30
+SERVICE_RETRY_S = 5
 
 RESAMPLE = Image.BILINEAR
+# Let Pillow box-reduce by an integer factor before the final resample
+REDUCING_GAP = 2.0
+
+# Grid
+TILE_PAD = 10
+# Extra rows of tiles kept alive above and below the viewport
+OVERSCAN_ROWS = int(os.environ.get("OVERSCAN_ROWS", "2"))
 
 # Threading
 MAX_WORKERS = 4
-# Dedicated background prefetch worker for animations
+# Decode backend: "thread" runs Pillow work on the worker threads, "process"
+# hands it to a pool of DECODE_PROCS processes so it is not bound by the GIL
+DECODE_BACKEND = os.environ.get("DECODE_BACKEND", "thread")
+DECODE_PROCS = int(os.environ.get("DECODE_PROCS", str(os.cpu_count() or 4)))
+# Finished thumbnails are turned into PhotoImages on the Tk thread in batches
+THUMB_APPLY_MS = 16
+THUMB_APPLY_BUDGET_MS = 8
+# At most this many workers run speculative prefetch at once (and always
+# one fewer than the pool, so on-screen work never waits for a free worker)
 PREFETCH_WORKERS = 6
 
+# Job priorities, lowest runs first
+PRIO_PREVIEW = 0
+PRIO_VISIBLE = 1
+PRIO_NEAR = 2
+PRIO_PREFETCH = 3
+
+
+class Profiler:
+    # Records complete ("X") events in Chrome trace format. When disabled,
+    # span() costs a single attribute check.
+    def __init__(self, target: str):
+        self.enabled = bool(target)
+        if target == "1":
+            target = str(Path(CACHE_DIR).expanduser() / f"trace-{os.getpid()}.json")
+        self.target = target
+        self.events: list[dict] = []
+        self.counters: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self._beat_expected = 0.0
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self.t0) * 1e6
+
+    def record(self, name: str, start_us: float, dur_us: float, **args):
+        ev = {"name": name, "ph": "X", "ts": start_us, "dur": dur_us,
+              "pid": os.getpid(), "tid": threading.get_ident(),
+              "args": args}
+        with self.lock:
+            self.events.append(ev)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        # Yields the args dict so callers can attach results (hit/miss, ...)
+        if not self.enabled:
+            yield args
+            return
+        start = self._now_us()
+        try:
+            yield args
+        finally:
+            self.record(name, start, self._now_us() - start, **args)
+
+    # Main-loop stall detection: a heartbeat that notes how late it fires
+    def watch_mainloop(self, widget: tk.Misc):
+        if not self.enabled:
+            return
+        self._beat_expected = time.perf_counter() + STALL_TICK_MS / 1000
+        widget.after(STALL_TICK_MS, self._beat, widget)
+
+    def _beat(self, widget: tk.Misc):
+        now = time.perf_counter()
+        late_ms = (now - self._beat_expected) * 1000
+        if late_ms > STALL_MS:
+            start = (self._beat_expected - self.t0) * 1e6
+            self.record("mainloop.stall", start, late_ms * 1000)
+        self._beat_expected = now + STALL_TICK_MS / 1000
+        try:
+            widget.after(STALL_TICK_MS, self._beat, widget)
+        except Exception:
+            pass
+
+    def summary(self) -> dict[str, dict]:
+        by_name: dict[str, list[float]] = defaultdict(list)
+        with self.lock:
+            for ev in self.events:
+                by_name[ev["name"]].append(ev["dur"] / 1000)
+        out = {}
+        for name, durs in sorted(by_name.items()):
+            durs.sort()
+            out[name] = {
+                "count": len(durs),
+                "total_ms": sum(durs),
+                "mean_ms": sum(durs) / len(durs),
+                "p95_ms": durs[min(len(durs) - 1, int(len(durs) * 0.95))],
+                "max_ms": durs[-1],
+            }
+        return out
+
+    def dump(self):
+        if not self.enabled:
+            return
+        summary = self.summary()
+        print(f"{'stage':<28}{'count':>7}{'total ms':>11}{'mean':>9}"
+              f"{'p95':>9}{'max':>9}", file=sys.stderr)
+        for name, st in summary.items():
+            print(f"{name:<28}{st['count']:>7}{st['total_ms']:>11.1f}"
+                  f"{st['mean_ms']:>9.2f}{st['p95_ms']:>9.2f}"
+                  f"{st['max_ms']:>9.2f}", file=sys.stderr)
+        for name, values in self.counters.items():
+            print(f"{name}: {values}", file=sys.stderr)
+        with self.lock:
+            data = {"traceEvents": list(self.events),
+                    "displayTimeUnit": "ms",
+                    "otherData": {"summary": summary,
+                                  "counters": self.counters}}
+        try:
+            Path(self.target).parent.mkdir(parents=True, exist_ok=True)
+            Path(self.target).write_text(json.dumps(data))
+            print(f"Trace written to {self.target}", file=sys.stderr)
+        except OSError as exc:
+            print(f"Could not write trace: {exc}", file=sys.stderr)
+
+
+PROFILER = Profiler(PROFILE)
+
+
+class LibraryIndex:
+    # Persisted manifest of WALL_DIR. Each directory records its mtime and
+    # listing; on refresh a directory whose mtime is unchanged is reused
+    # without listing it or stat'ing its files, so a warm scan costs one
+    # stat per directory. Files carry [size, mtime_ns, w, h, animated,
+    # n_frames], probed from the image header when new or changed.
+    VERSION = 1
+
+    def __init__(self, root: Path):
+        self.root = root
+        key = hashlib.sha1(str(root).encode("utf-8", "surrogateescape"))
+        self.path = (Path(CACHE_DIR).expanduser()
+                     / f"index-{key.hexdigest()[:12]}.json")
+        self.dirs: dict[str, dict] = {}
+        self.files: dict[str, list] = {}
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.VERSION or data.get("root") != str(self.root):
+            return
+        self.dirs = data.get("dirs", {})
+        self.files = data.get("files", {})
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {"version": self.VERSION, "root": str(self.root),
+                "dirs": self.dirs, "files": self.files}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(data, separators=(",", ":")))
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except OSError:
+            pass
+
+    @staticmethod
+    def probe(path: str, st: os.stat_result) -> list:
+        w = h = 0
+        animated = False
+        n_frames = 1
+        try:
+            with Image.open(path) as im:
+                w, h = im.size
+                animated = bool(getattr(im, "is_animated", False))
+                n_frames = int(getattr(im, "n_frames", 1))
+        except Exception:
+            pass
+        return [st.st_size, st.st_mtime_ns, w, h, animated, n_frames]
+
+    def refresh(self) -> List[Path]:
+        seen_dirs: set[str] = set()
+        seen_files: set[str] = set()
+        stack = [str(self.root)]
+        while stack:
+            d = stack.pop()
+            try:
+                mtime = os.stat(d).st_mtime_ns
+            except OSError:
+                continue
+            seen_dirs.add(d)
+            cached = self.dirs.get(d)
+            if cached is None or cached["mtime"] != mtime:
+                cached = self._scan_dir(d, mtime)
+            for name in cached["files"]:
+                seen_files.add(os.path.join(d, name))
+            stack.extend(os.path.join(d, name) for name in cached["subdirs"])
+
+        for gone in self.dirs.keys() - seen_dirs:
+            del self.dirs[gone]
+            self.dirty = True
+        for gone in self.files.keys() - seen_files:
+            del self.files[gone]
+            self.dirty = True
+        return sorted(Path(p) for p in seen_files)
+
+    def _scan_dir(self, d: str, mtime: int) -> dict:
+        files: list[str] = []
+        subdirs: list[str] = []
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                            continue
+                        if (not entry.is_file()
+                                or Path(entry.name).suffix.lower() not in SUPPORTED_EXT):
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files.append(entry.name)
+                    rec = self.files.get(entry.path)
+                    if rec is None or rec[0] != st.st_size or rec[1] != st.st_mtime_ns:
+                        self.files[entry.path] = self.probe(entry.path, st)
+        except OSError:
+            pass
+        entry = {"mtime": mtime, "files": files, "subdirs": subdirs}
+        self.dirs[d] = entry
+        self.dirty = True
+        return entry
+
+    def info(self, path: Path) -> Optional[list]:
+        return self.files.get(str(path))
+
+
+def find_images(dir_path: Path) -> List[Path]:
+    if not dir_path.exists():
+        return []
+    index = LibraryIndex(dir_path)
+    out = index.refresh()
+    index.save()
+    return out
+
+
+# The file list the grid was last built from, one path per line. Much
+# cheaper to read than the index, so the window can be laid out before the
+# library is scanned; the scan runs after the first paint and corrects it.
+def _snapshot_path(root: Path) -> Path:
+    key = hashlib.sha1(str(root).encode("utf-8", "surrogateescape"))
+    return Path(CACHE_DIR).expanduser() / f"grid-{key.hexdigest()[:12]}.txt"
+
+
+def load_grid_snapshot(root: Path) -> Optional[List[Path]]:
+    try:
+        text = _snapshot_path(root).read_text(errors="surrogateescape")
+    except OSError:
+        return None
+    return [Path(line) for line in text.splitlines() if line] or None
+
+
+def save_grid_snapshot(root: Path, files: List[Path]):
+    path = _snapshot_path(root)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text("".join(f"{p}\n" for p in files),
+                       errors="surrogateescape")
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+class SearchIndex:
+    # In-memory search over the library for the picker's search box.
+    # Plain terms match file names (relative to WALL_DIR, lowercased) as
+    # substrings; once build_grams() has run, candidates come from the
+    # rarest trigram's posting list, so a keystroke touches a few hundred
+    # names rather than all of them (before that, names are scanned). A
+    # term with no substring match falls back to an in-order (fuzzy)
+    # character match, prefiltered by a per-name character bitmask.
+    # Filter terms use the LibraryIndex metadata and FeatureIndex colours:
+    #   is:anim / is:static   ext:gif   w>=1920  h<1080   ar:wide|tall|square|16:9
+    #   color:red / color:#ff8800   sort:hue
+    # Every term narrows the result, so a query that extends the previous
+    # one (more characters or more terms) is run on the previous result,
+    # unless the edited term was a filter or a term newly went fuzzy.
+    FILTER_OPS = (">=", "<=", ">", "<", "=")
+    COLOURS = {
+        "red": (200, 40, 40), "orange": (230, 130, 30),
+        "yellow": (230, 210, 50), "green": (60, 160, 60),
+        "cyan": (40, 190, 200), "blue": (40, 80, 200),
+        "purple": (130, 60, 180), "pink": (230, 120, 180),
+        "brown": (120, 80, 40), "black": (10, 10, 10),
+        "white": (240, 240, 240), "gray": (128, 128, 128),
+        "grey": (128, 128, 128),
+    }
+    # A colour matches when the image's colour groups close to it cover at
+    # least COLOUR_SHARE together: for a chromatic colour, groups within
+    # COLOUR_HUE of its hue and COLOUR_VALUE of its brightness; for black,
+    # grey and white, near-grey groups within COLOUR_GREY of its brightness
+    COLOUR_SHARE = 0.1
+    COLOUR_HUE = 25 / 360
+    COLOUR_VALUE = 0.45
+    COLOUR_GREY = 0.25
+
+    def __init__(self, files: List[Path], root: Path,
+                 meta: list[Optional[list]],
+                 colours: Optional[list[Optional[list]]] = None):
+        self.files = files
+        prefix = str(root).rstrip("/") + "/"
+        self.names: list[str] = []
+        for p in files:
+            name = str(p)
+            name = name[len(prefix):] if name.startswith(prefix) else p.name
+            self.names.append(name.lower())
+        # (w, h, animated) per file; unknown sizes are 0
+        self.meta = [(m[2], m[3], bool(m[4])) if m else
+                     (0, 0, p.suffix.lower() in (".gif", ".webp"))
+                     for p, m in zip(files, meta)]
+        self.colours = colours or [None] * len(files)
+        self.grams: Optional[dict[str, list[int]]] = None
+        self.masks: Optional[list[int]] = None
+        self.last_query = ""
+        self.last_ids: Optional[list[int]] = None
+        self.last_fuzzy = False
+
+    @staticmethod
+    def _mask(text: str) -> int:
+        m = 0
+        for c in set(text):
+            m |= 1 << (ord(c) & 63)
+        return m
+
+    def build_grams(self):
+        # The slow part (about a second per 50k files), run on a worker;
+        # searches keep working meanwhile
+        grams: dict[str, list[int]] = defaultdict(list)
+        for i, name in enumerate(self.names):
+            for g in {name[j:j + 3] for j in range(len(name) - 2)}:
+                grams[g].append(i)
+        self.masks = [self._mask(name) for name in self.names]
+        self.grams = grams
+
+    def search(self, query: str) -> list[int]:
+        query = query.lower()
+        words = query.split()
+        sort = [w for w in words if w.startswith("sort:")]
+        if sort:
+            # Ordering does not change the matches; search without it
+            ids = self.search(" ".join(w for w in words if w not in sort))
+            return self._sort(sort[-1][5:], ids)
+        if not words:
+            self.last_query, self.last_ids, self.last_fuzzy = query, None, False
+            return list(range(len(self.files)))
+        old = self.last_query.split()
+        base = None
+        if (self.last_ids is not None and old
+                and query.startswith(self.last_query)
+                and not self._is_filter(old[-1])):
+            base = self.last_ids
+        ids, fuzzy = self._run(words, base)
+        if base is not None and fuzzy and not self.last_fuzzy:
+            # Fuzzy matches may lie outside the previous substring matches
+            ids, fuzzy = self._run(words, None)
+        self.last_query, self.last_ids, self.last_fuzzy = query, ids, fuzzy
+        return ids
+
+    def _run(self, words: list[str], ids: Optional[list[int]]
+             ) -> tuple[list[int], bool]:
+        fuzzy = False
+        for w in words:
+            if self._is_filter(w):
+                ids = self._filter(w, ids)
+            else:
+                ids, used_fuzzy = self._term(w, ids)
+                fuzzy = fuzzy or used_fuzzy
+            if not ids:
+                return [], fuzzy
+        return ids, fuzzy
+
+    def _is_filter(self, word: str) -> bool:
+        if word.startswith(("is:", "ext:", "ar:", "color:", "colour:")):
+            return True
+        return word[:1] in ("w", "h") and word[1:2] in "<>=" and len(word) > 1
+
+    def _term(self, term: str, ids: Optional[list[int]]
+              ) -> tuple[list[int], bool]:
+        names = self.names
+        grams = self.grams
+        if len(term) >= 3 and grams is not None:
+            postings = [grams.get(term[j:j + 3])
+                        for j in range(len(term) - 2)]
+            if all(postings):
+                cands = min(postings, key=len)
+                if ids is not None and len(ids) < len(cands):
+                    cands = ids
+                elif ids is not None:
+                    allowed = set(ids)
+                    cands = [i for i in cands if i in allowed]
+                hits = [i for i in cands if term in names[i]]
+            else:
+                hits = []
+        else:
+            pool = range(len(names)) if ids is None else ids
+            hits = [i for i in pool if term in names[i]]
+        if hits:
+            return hits, False
+        # Fuzzy: the term's characters in order, anything in between
+        import re
+
+        # "a[^b]*b[^c]*c": first-occurrence matching, no backtracking
+        pattern = re.compile(re.escape(term[0]) + "".join(
+            f"[^{re.escape(c)}]*{re.escape(c)}" for c in term[1:]))
+        pool = range(len(names)) if ids is None else ids
+        masks = self.masks
+        if masks is not None:
+            need = self._mask(term)
+            pool = [i for i in pool if masks[i] & need == need]
+        return [i for i in pool if pattern.search(names[i])], True
+
+    def _filter(self, word: str, ids: Optional[list[int]]) -> list[int]:
+        pool = range(len(self.files)) if ids is None else ids
+        meta = self.meta
+        if word.startswith("is:"):
+            want = word[3:]
+            if want.startswith("anim"):
+                return [i for i in pool if meta[i][2]]
+            if want.startswith("stat"):
+                return [i for i in pool if not meta[i][2]]
+            return list(pool)
+        if word.startswith("ext:"):
+            ext = "." + word[4:].lstrip(".")
+            return [i for i in pool if self.names[i].endswith(ext)]
+        if word.startswith(("color:", "colour:")):
+            target = self._parse_colour(word.split(":", 1)[1])
+            if target is None:
+                return list(pool)
+            target = self._hsv(target)
+            return [i for i in pool if self._has_colour(self.colours[i], target)]
+        if word.startswith("ar:"):
+            lo, hi = self._aspect_range(word[3:])
+            return [i for i in pool
+                    if meta[i][1] and lo <= meta[i][0] / meta[i][1] <= hi]
+        key, rest = word[0], word[1:]
+        for op in self.FILTER_OPS:
+            if rest.startswith(op):
+                try:
+                    n = int(rest[len(op):])
+                except ValueError:
+                    # Still being typed
+                    return list(pool)
+                col = 0 if key == "w" else 1
+                test = {">=": n.__le__, "<=": n.__ge__, ">": n.__lt__,
+                        "<": n.__gt__, "=": n.__eq__}[op]
+                return [i for i in pool if test(meta[i][col])]
+        return list(pool)
+
+    def _parse_colour(self, text: str) -> Optional[tuple[int, int, int]]:
+        if text in self.COLOURS:
+            return self.COLOURS[text]
+        text = text.lstrip("#")
+        if len(text) == 6:
+            try:
+                return tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+            except ValueError:
+                return None
+        return None
+
+    @staticmethod
+    def _hsv(c) -> tuple[float, float, float, bool]:
+        import colorsys
+
+        h, s, v = colorsys.rgb_to_hsv(c[0] / 255, c[1] / 255, c[2] / 255)
+        return h, s, v, s < 0.2 or v < 0.15
+
+    def _has_colour(self, colours: Optional[list], target) -> bool:
+        if not colours:
+            return False
+        th, _, tv, tgrey = target
+        share = 0.0
+        for c in colours:
+            h, _, v, grey = self._hsv(c)
+            if tgrey:
+                ok = grey and abs(v - tv) <= self.COLOUR_GREY
+            else:
+                d = abs(h - th)
+                ok = (not grey and min(d, 1 - d) <= self.COLOUR_HUE
+                      and abs(v - tv) <= self.COLOUR_VALUE)
+            if ok:
+                share += c[3]
+        return share >= self.COLOUR_SHARE
+
+    def _sort(self, key: str, ids: list[int]) -> list[int]:
+        if key not in ("hue", "color", "colour"):
+            return ids
+        import colorsys
+
+        def hue(i: int) -> tuple[int, float, float]:
+            # Greys (low saturation) after the colours, dark to light
+            for r, g, b, _ in self.colours[i] or []:
+                h, l, sat = colorsys.rgb_to_hls(r / 255, g / 255, b / 255)
+                if sat > 0.25 and 0.1 < l < 0.9:
+                    return (0, h, l)
+            top = (self.colours[i] or [[0, 0, 0, 0]])[0]
+            return (1, 0.0, sum(top[:3]) / 765)
+
+        return sorted(ids, key=hue)
+
+    @staticmethod
+    def _aspect_range(want: str) -> tuple[float, float]:
+        named = {"wide": (1.5, math.inf), "tall": (0.0, 0.9),
+                 "square": (0.9, 1.1)}
+        if want in named:
+            return named[want]
+        try:
+            a, b = (float(v) for v in want.split(":"))
+            return a / b * 0.97, a / b * 1.03
+        except (ValueError, ZeroDivisionError):
+            # Still being typed
+            return 0.0, math.inf
+
+
+class DirWatcher:
+    # inotify (via libc, no extra dependencies) on every indexed directory.
+    # A daemon thread waits for events, lets bursts settle, re-runs the
+    # incremental index refresh and hands the new file list to on_change.
+    # on_change runs on the watcher thread. Watches of directories that
+    # leave the index are removed, and IN_IGNORED (the kernel dropping a
+    # watch, e.g. on delete) forgets one, so a directory recreated at the
+    # same path is watched again.
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_IGNORED = 0x8000
+    IN_CLOEXEC = 0o2000000
+    MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+            | IN_DELETE | IN_DELETE_SELF)
+    SETTLE_S = 0.3
+
+    def __init__(self, index: LibraryIndex, on_change):
+        self.index = index
+        self.on_change = on_change
+        import ctypes
+
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched: dict[str, int] = {}  # directory -> watch descriptor
+        self.dirs: dict[int, str] = {}
+        self.closed = False
+        self._watch_all()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _watch_all(self):
+        for d in [d for d in self.watched if d not in self.index.dirs]:
+            wd = self.watched.pop(d)
+            if self.dirs.get(wd) == d:
+                del self.dirs[wd]
+                self.libc.inotify_rm_watch(self.fd, wd)
+        for d in self.index.dirs:
+            if d not in self.watched:
+                wd = self.libc.inotify_add_watch(
+                    self.fd, os.fsencode(d), self.MASK)
+                if wd >= 0:
+                    # The same directory under a new path (renamed) keeps
+                    # its descriptor
+                    old = self.dirs.get(wd)
+                    if old is not None:
+                        self.watched.pop(old, None)
+                    self.watched[d] = wd
+                    self.dirs[wd] = d
+
+    def _forget(self, wd: int):
+        d = self.dirs.pop(wd, None)
+        if d is not None and self.watched.get(d) == wd:
+            del self.watched[d]
+
+    def _drain(self, timeout: Optional[float]) -> bool:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        buf = os.read(self.fd, 64 * 1024)
+        # struct inotify_event: wd, mask, cookie, len, name[len]; beyond
+        # dropped watches the contents do not matter, the index refresh
+        # finds what changed
+        off = 0
+        while off + 16 <= len(buf):
+            wd, mask, _, name_len = struct.unpack_from("iIII", buf, off)
+            if mask & self.IN_IGNORED:
+                self._forget(wd)
+            off += 16 + name_len
+        return True
+
+    def _run(self):
+        while not self.closed:
+            try:
+                if not self._drain(None):
+                    continue
+                while self._drain(self.SETTLE_S):
+                    pass
+            except OSError:
+                return
+            if self.closed:
+                return
+            files = self.index.refresh()
+            self.index.save()
+            self._watch_all()
+            self.on_change(files)
+
+    def close(self):
+        self.closed = True
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+def _open_reduced(path: Path, size: tuple[int, int]) -> Image.Image:
+    # Open an image and ask the decoder for the smallest scale that still
+    # covers `size` (JPEG DCT scaling); other formats decode at full size
+    # and are box-reduced in _resize_cover_16x9 via REDUCING_GAP
+    im = Image.open(path)
+    if im.format == "JPEG":
+        src_w, src_h = im.size
+        scale = max(size[0] / src_w, size[1] / src_h)
+        if scale < 1:
+            im.draft("RGB", (math.ceil(src_w * scale),
+                             math.ceil(src_h * scale)))
+    return im
+
+
+def preview_bucket(box: tuple[int, int]) -> tuple[int, int]:
+    b = PREVIEW_BUCKET
+    return (-(-box[0] // b) * b, -(-box[1] // b) * b)
+
+
+def fits_whole(n_frames: int, size: tuple[int, int]) -> bool:
+    # Whether an animation decoded at size stays within STREAM_FULL_MB;
+    # larger ones are only ever streamed through a window
+    return n_frames * size[0] * size[1] * 4 <= STREAM_FULL_MB * 1024 * 1024
+
+
+def _resize_cover_16x9(im: Image.Image, size: tuple[int, int]) -> Image.Image:
+    # Scale to fill and center-crop to exactly the requested size, preserving aspect
+    target_w, target_h = size
+    im2 = im
+    if im2.mode not in ("RGB", "RGBA"):
+        im2 = im2.convert("RGB")
+
+    src_w, src_h = im2.size
+    # Compute scale to cover the target box
+    scale = max(target_w / src_w, target_h / src_h)
+    new_w, new_h = int(round(src_w * scale)), int(round(src_h * scale))
+    im2 = im2.resize((new_w, new_h), RESAMPLE, reducing_gap=REDUCING_GAP)
+
+    # Center-crop to target size
+    left = max(0, (new_w - target_w) // 2)
+    top = max(0, (new_h - target_h) // 2)
+    im2 = im2.crop((left, top, left + target_w, top + target_h))
+
+    # If RGBA, composite onto a solid background to avoid Tk transparency issues
+    if im2.mode == "RGBA":
+        bg = Image.new("RGB", (target_w, target_h), (43, 43, 43))
+        bg.paste(im2, (0, 0), im2)
+        return bg
+    return im2
+
+
+def _resize_cover_region(
+    im: Image.Image, size: tuple[int, int], prev: Image.Image,
+    src_box: tuple[int, int, int, int]
+) -> Image.Image:
+    # Like _resize_cover_16x9, but only the output pixels that depend on
+    # src_box (the area that changed since the frame `prev` was resized
+    # from) are resampled; everything else is copied from prev
+    target_w, target_h = size
+    src_w, src_h = im.size
+    scale = max(target_w / src_w, target_h / src_h)
+    new_w, new_h = int(round(src_w * scale)), int(round(src_h * scale))
+    sx, sy = new_w / src_w, new_h / src_h
+    left = max(0, (new_w - target_w) // 2)
+    top = max(0, (new_h - target_h) // 2)
+    # One pixel of margin covers the bilinear filter's reach
+    ox0 = max(0, math.floor(src_box[0] * sx) - left - 1)
+    oy0 = max(0, math.floor(src_box[1] * sy) - top - 1)
+    ox1 = min(target_w, math.ceil(src_box[2] * sx) - left + 1)
+    oy1 = min(target_h, math.ceil(src_box[3] * sy) - top + 1)
+    out = prev.copy()
+    if ox1 <= ox0 or oy1 <= oy0:
+        return out
+    box = ((left + ox0) / sx, (top + oy0) / sy,
+           (left + ox1) / sx, (top + oy1) / sy)
+    region = im.resize((ox1 - ox0, oy1 - oy0), RESAMPLE, box=box)
+    if region.mode == "RGBA":
+        bg = Image.new("RGB", region.size, (43, 43, 43))
+        bg.paste(region, (0, 0), region)
+        region = bg
+    out.paste(region, (ox0, oy0))
+    return out
+
+
+def _changed_box(
+    im: Image.Image, prev: Optional[Image.Image], cur: Image.Image,
+    prev_extent: Optional[tuple[int, int, int, int]]
+) -> Optional[tuple[int, int, int, int]]:
+    # Source-pixel box that differs between two consecutive composited
+    # frames. GIF frames only touch their own extent plus whatever the
+    # previous frame's disposal restored, so no pixel diff is needed there.
+    extent = getattr(im, "dispose_extent", None)
+    if extent is not None and prev_extent is not None:
+        return (min(extent[0], prev_extent[0]), min(extent[1], prev_extent[1]),
+                max(extent[2], prev_extent[2]), max(extent[3], prev_extent[3]))
+    if prev is None or prev.mode != cur.mode:
+        return (0, 0) + cur.size
+    from PIL import ImageChops
+
+    return ImageChops.difference(prev, cur).getbbox(alpha_only=False)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+_job_local = threading.local()
+
+
+def checkpoint():
+    # Called from long decode loops; aborts the running job once it has
+    # been cancelled (see Job.cancel)
+    job = getattr(_job_local, "job", None)
+    if job is not None and job.stop_requested:
+        raise JobCancelled()
+
+
+class Job(Future):
+    def __init__(self, name: str, fn, args: tuple, priority: int):
+        super().__init__()
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.stop_requested = False
+        self.queued_us = 0.0
+
+    def cancel(self) -> bool:
+        # Pending jobs are dropped; running ones stop at their next
+        # checkpoint() and finish with JobCancelled
+        self.stop_requested = True
+        return super().cancel()
+
+
+class WorkScheduler:
+    # One bounded pool of worker threads for all picker jobs, served in
+    # priority order (preview > visible > near viewport > prefetch). The
+    # priority of a queued job can be changed; stale heap entries are
+    # skipped when popped.
+    def __init__(self, workers: int, speculative: int):
+        self.cond = threading.Condition()
+        self.heap: list[tuple[int, int, Job]] = []
+        self.seq = 0
+        self.active: set[Job] = set()
+        self.running_speculative = 0
+        self.max_speculative = speculative
+        self.closed = False
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"picker-worker-{i}",
+                             daemon=True).start()
+
+    def submit(self, name: str, fn, *args, priority: int = PRIO_VISIBLE) -> Job:
+        job = Job(name, fn, args, priority)
+        job.queued_us = PROFILER._now_us()
+        with self.cond:
+            if self.closed:
+                job.cancel()
+                return job
+            self._push(job)
+        return job
+
+    def _push(self, job: Job):
+        self.seq += 1
+        heapq.heappush(self.heap, (job.priority, self.seq, job))
+        self.cond.notify()
+
+    def set_speculative(self, n: int):
+        with self.cond:
+            self.max_speculative = n
+            self.cond.notify_all()
+
+    def reprioritize(self, job: Optional[Job], priority: int):
+        if job is None or job.priority == priority or job.done():
+            return
+        with self.cond:
+            job.priority = priority
+            if not job.running():
+                self._push(job)
+
+    def _next_job(self) -> Optional[Job]:
+        while self.heap:
+            prio, _, job = self.heap[0]
+            if job.priority != prio or job.done() or job.running():
+                heapq.heappop(self.heap)
+                continue
+            if (prio >= PRIO_PREFETCH
+                    and self.running_speculative >= self.max_speculative):
+                return None
+            heapq.heappop(self.heap)
+            return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                job = None
+                while not self.closed:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    self.cond.wait()
+                if job is None:
+                    return
+                if not job.set_running_or_notify_cancel():
+                    continue
+                self.active.add(job)
+                speculative = job.priority >= PRIO_PREFETCH
+                if speculative:
+                    self.running_speculative += 1
+            self._run(job)
+            with self.cond:
+                self.active.discard(job)
+                if speculative:
+                    self.running_speculative -= 1
+                    self.cond.notify_all()
+
+    def _run(self, job: Job):
+        _job_local.job = job
+        start = PROFILER._now_us()
+        try:
+            if PROFILER.enabled:
+                PROFILER.record(f"queue:{job.name}", job.queued_us,
+                                start - job.queued_us)
+            with PROFILER.span(job.name, priority=job.priority):
+                result = job.fn(*job.args)
+        except BaseException as exc:
+            job.set_exception(exc)
+        else:
+            job.set_result(result)
+        finally:
+            _job_local.job = None
+
+    def shutdown(self):
+        with self.cond:
+            self.closed = True
+            for _, _, job in self.heap:
+                job.cancel()
+            for job in self.active:
+                job.cancel()
+            self.heap.clear()
+            self.cond.notify_all()
+
+
+class ThumbCache:
+    # Persistent cache of cover-cropped thumbnails, stored as small JPEGs.
+    # File name = <hash(path)>-<hash(mtime, size, thumb size)>.jpg, so a changed
+    # source simply misses and its stale siblings are dropped on the next store.
+    # Hits touch the file mtime, which doubles as the LRU clock for eviction.
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _path_prefix(path: Path) -> str:
+        raw = str(path).encode("utf-8", "surrogateescape")
+        return hashlib.sha1(raw).hexdigest()[:16]
+
+    def _entry(self, path: Path, size: tuple[int, int]) -> Optional[Path]:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        stamp = f"{st.st_mtime_ns}:{st.st_size}:{size[0]}x{size[1]}"
+        digest = hashlib.sha1(stamp.encode()).hexdigest()[:16]
+        prefix = self._path_prefix(path)
+        # Shard by prefix so stale-sibling lookups only list a small directory
+        return self.root / prefix[:2] / f"{prefix}-{digest}.jpg"
+
+    def get(self, path: Path, size: tuple[int, int]) -> Optional[Image.Image]:
+        entry = self._entry(path, size)
+        if entry is None:
+            return None
+        try:
+            im = Image.open(entry)
+            im.load()
+        except Exception:
+            return None
+        if im.size != size:
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return im
+
+    def put(self, path: Path, size: tuple[int, int], im: Image.Image):
+        entry = self._entry(path, size)
+        if entry is None:
+            return
+        with self._lock:
+            if self._total is None:
+                self._total = sum(self._file_size(p) for p in self._entries())
+            try:
+                entry.parent.mkdir(parents=True, exist_ok=True)
+                # Drop entries for older versions of the same source
+                prefix = self._path_prefix(path)
+                for old in entry.parent.glob(f"{prefix}-*.jpg"):
+                    if old != entry:
+                        self._total -= self._file_size(old)
+                        old.unlink(missing_ok=True)
+                tmp = entry.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+                im.convert("RGB").save(
+                    tmp, "JPEG", quality=THUMB_CACHE_QUALITY)
+                os.replace(tmp, entry)
+                self._total += self._file_size(entry)
+            except Exception:
+                return
+            if self._total > self.max_bytes:
+                self._prune_locked()
+
+    def prune(self):
+        with self._lock:
+            self._prune_locked()
+
+    @staticmethod
+    def _file_size(p: Path) -> int:
+        try:
+            return p.stat().st_size
+        except OSError:
+            return 0
+
+    def _entries(self):
+        return self.root.glob("*/*.jpg")
+
+    def _prune_locked(self):
+        # Evict least recently used entries until 90% of the budget is used
+        try:
+            entries = []
+            for p in self._entries():
+                st = p.stat()
+                entries.append((st.st_mtime, st.st_size, p))
+        except OSError:
+            return
+        entries.sort()
+        total = sum(sz for _, sz, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, sz, p in entries:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+                total -= sz
+            except OSError:
+                pass
+        self._total = total
+
+
+THUMB_DISK_CACHE = ThumbCache(
+    Path(CACHE_DIR).expanduser() / "thumbs", THUMB_CACHE_MB * 1024 * 1024
+)
+
+
+class ThumbAtlas:
+    # Thumbnails of one size packed into a single file of fixed-size slots
+    # (a 16-byte key, hash of path/mtime/size, then raw RGB), located by an
+    # offset index saved next to it (path -> [slot, mtime_ns, size, last
+    # used]). Reads copy a slice of the mmap'd file straight into an image.
+    # New thumbnails fill holes first, then are appended; beyond max_bytes
+    # (0: unbounded) the least recently used slot is reused. prune() frees the slots of
+    # removed files, moves the last entries into the holes and truncates.
+    # One process at a time writes (it holds the .lock file); the others
+    # read, re-loading the index when it changes. A slot whose key does not
+    # match is a miss, so a stale index never shows the wrong thumbnail.
+    # Every process holds a shared flock on the data file while mapping it
+    # and the writer only shrinks the file when it can take it exclusively:
+    # touching a mapped page past the end of a file raises SIGBUS.
+    VERSION = 1
+    KEY_BYTES = 16
+
+    def __init__(self, root: Path, size: tuple[int, int], max_bytes: int):
+        self.root = root
+        self.size = size
+        self.max_bytes = max_bytes
+        self.slot_bytes = self.KEY_BYTES + size[0] * size[1] * 3
+        name = f"atlas-{size[0]}x{size[1]}"
+        self.data_path = root / f"{name}.bin"
+        self.index_path = root / f"{name}.json"
+        self.lock_path = root / f"{name}.lock"
+        self.lock = threading.Lock()
+        self.opened = False
+        self.writable = False
+        self.fd = -1
+        self.lock_fd = -1
+        self.map = None
+        self.entries: dict[str, list] = {}
+        self.free: list[int] = []  # heap of unused slots below self.slots
+        self.slots = 0
+        self.clock = 0
+        self.dirty = False
+        self.saved = 0.0
+        self.index_mtime = 0
+        self.checked = 0.0
+
+    def _open(self) -> bool:
+        # On first use; False when the atlas is disabled or unusable
+        if self.opened:
+            return self.fd >= 0
+        self.opened = True
+        if not ATLAS:
+            return False
+        import fcntl
+
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.lock_fd = os.open(
+                self.lock_path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            try:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.writable = True
+            except OSError:
+                os.close(self.lock_fd)
+                self.lock_fd = -1
+            flags = os.O_RDWR | os.O_CREAT if self.writable else os.O_RDONLY
+            self.fd = os.open(self.data_path, flags | os.O_CLOEXEC, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_SH)
+        except OSError:
+            if self.fd >= 0:
+                os.close(self.fd)
+            self.fd = -1
+            return False
+        self._load()
+        if self.writable:
+            import atexit
+
+            atexit.register(self.save)
+        return True
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+            data = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            mtime, data = 0, {}
+        self.index_mtime = mtime
+        self.checked = time.monotonic()
+        if (data.get("version") != self.VERSION
+                or data.get("size") != list(self.size)):
+            data = {}
+        self.entries = data.get("entries", {})
+        self.clock = max((e[3] for e in self.entries.values()), default=0)
+        if self.writable:
+            # Slots past the end of the file (a crash before the data was
+            # written) are forgotten
+            self.slots = os.fstat(self.fd).st_size // self.slot_bytes
+            self.entries = {p: e for p, e in self.entries.items()
+                            if e[0] < self.slots}
+            used = {e[0] for e in self.entries.values()}
+            self.free = [i for i in range(self.slots) if i not in used]
+
+    def _reload(self):
+        # Readers pick up the writer's new entries, at most once a second
+        if time.monotonic() - self.checked < 1.0:
+            return
+        self.checked = time.monotonic()
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self.index_mtime:
+            self._load()
+
+    def _view(self, slot: int) -> Optional[memoryview]:
+        end = (slot + 1) * self.slot_bytes
+        if self.map is None or len(self.map) < end:
+            size = os.fstat(self.fd).st_size
+            if size < end:
+                return None
+            import mmap
+
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.fd, size, prot=mmap.PROT_READ)
+        return memoryview(self.map)[end - self.slot_bytes:end]
+
+    def _key(self, path: Path, st: os.stat_result) -> bytes:
+        raw = f"{path}\0{st.st_mtime_ns}\0{st.st_size}"
+        return hashlib.sha1(
+            raw.encode("utf-8", "surrogateescape")).digest()[:self.KEY_BYTES]
+
+    def get(self, path: Path, size: tuple[int, int]) -> Optional[Image.Image]:
+        if size != self.size:
+            return None
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        with self.lock:
+            if not self._open():
+                return None
+            rec = self.entries.get(str(path))
+            if rec is None and not self.writable:
+                self._reload()
+                rec = self.entries.get(str(path))
+            if rec is None or rec[1] != st.st_mtime_ns or rec[2] != st.st_size:
+                return None
+            view = self._view(rec[0])
+            if view is None:
+                return None
+            with view, view[self.KEY_BYTES:] as pixels:
+                if view[:self.KEY_BYTES] != self._key(path, st):
+                    return None
+                im = Image.frombytes("RGB", self.size, pixels)
+            self.clock += 1
+            rec[3] = self.clock
+            self.dirty = True  # saved with the next put or on exit
+            return im
+
+    def put(self, path: Path, size: tuple[int, int], im: Image.Image):
+        if size != self.size or im.size != size:
+            return
+        try:
+            st = path.stat()
+        except OSError:
+            return
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        data = self._key(path, st) + im.tobytes()
+        with self.lock:
+            if not self._open() or not self.writable:
+                return
+            rec = self.entries.get(str(path))
+            slot = rec[0] if rec is not None else self._alloc()
+            if slot is None:
+                return
+            try:
+                os.pwrite(self.fd, data, slot * self.slot_bytes)
+            except OSError:
+                if rec is None:
+                    heapq.heappush(self.free, slot)
+                return
+            self.slots = max(self.slots, slot + 1)
+            self.clock += 1
+            self.entries[str(path)] = [slot, st.st_mtime_ns, st.st_size,
+                                       self.clock]
+            self.dirty = True
+            if time.monotonic() - self.saved >= ATLAS_SAVE_S:
+                self._save_locked()
+
+    def capacity(self) -> Optional[int]:
+        # Slots the budget allows, None when unbounded
+        return self.max_bytes // self.slot_bytes if self.max_bytes else None
+
+    def _alloc(self) -> Optional[int]:
+        if self.free:
+            return heapq.heappop(self.free)
+        if (not self.max_bytes
+                or (self.slots + 1) * self.slot_bytes <= self.max_bytes):
+            return self.slots
+        if not self.entries:
+            return None
+        victim = min(self.entries, key=lambda p: self.entries[p][3])
+        return self.entries.pop(victim)[0]
+
+    def missing(self, files: List[Path], index: LibraryIndex) -> List[Path]:
+        with self.lock:
+            if not self._open():
+                return []
+            out = []
+            for p in files:
+                rec, info = self.entries.get(str(p)), index.info(p)
+                if (rec is None or info is None
+                        or rec[1] != info[1] or rec[2] != info[0]):
+                    out.append(p)
+            return out
+
+    def prune(self, files: List[Path]):
+        keep = {str(p) for p in files}
+        with self.lock:
+            if not self._open() or not self.writable:
+                return
+            for gone in self.entries.keys() - keep:
+                heapq.heappush(self.free, self.entries.pop(gone)[0])
+                self.dirty = True
+            if self.free:
+                self._compact()
+            self._save_locked()
+
+    def _compact(self):
+        # Fill the lowest holes from the highest slots, then truncate. The
+        # index is saved before the file shrinks so it never points past
+        # the end; readers with an older index see key mismatches
+        import fcntl
+
+        by_slot = {e[0]: p for p, e in self.entries.items()}
+        top = self.slots - 1
+        for hole in sorted(self.free):
+            while top > hole and top not in by_slot:
+                top -= 1
+            if top <= hole:
+                break
+            with self._view(top) as view:
+                data = bytes(view)
+            try:
+                os.pwrite(self.fd, data, hole * self.slot_bytes)
+            except OSError:
+                break
+            p = by_slot.pop(top)
+            self.entries[p][0] = hole
+            by_slot[hole] = p
+            top -= 1
+        end = max(by_slot, default=-1) + 1
+        self.dirty = True
+        self._save_locked()
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            pass  # mapped elsewhere; shrunk on a later prune
+        else:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            try:
+                os.ftruncate(self.fd, end * self.slot_bytes)
+                self.slots = end
+            except OSError:
+                pass
+        # (Re)taken either way: a failed conversion may have dropped it
+        fcntl.flock(self.fd, fcntl.LOCK_SH)
+        self.free = [i for i in range(self.slots) if i not in by_slot]
+
+    def save(self):
+        with self.lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        self.saved = time.monotonic()
+        if not self.dirty or not self.writable:
+            return
+        data = {"version": self.VERSION, "size": list(self.size),
+                "entries": self.entries}
+        try:
+            tmp = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(data, separators=(",", ":")))
+            os.replace(tmp, self.index_path)
+            self.dirty = False
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            if not self._open():
+                return {"entries": 0, "bytes": 0, "holes": 0, "writable": False}
+            return {"entries": len(self.entries),
+                    "bytes": os.fstat(self.fd).st_size,
+                    "holes": len(self.free), "writable": self.writable}
+
+
+THUMB_ATLAS = ThumbAtlas(
+    Path(CACHE_DIR).expanduser(), THUMB_SIZE, ATLAS_MB * 1024 * 1024
+)
+
+
+def build_static_thumb_image(path: Path, size: tuple[int, int]) -> Image.Image:
+    with PROFILER.span("thumb.build") as info:
+        cached = THUMB_DISK_CACHE.get(path, size)
+        info["cache_hit"] = cached is not None
+        if cached is not None:
+            return cached
+        try:
+            with PROFILER.span("thumb.decode"):
+                im = _open_reduced(path, size)
+                if im.mode not in ("RGB", "RGBA"):
+                    im = im.convert("RGB")
+                im.load()
+            checkpoint()
+            with PROFILER.span("thumb.resize"):
+                frame = _resize_cover_16x9(im, size)
+        except JobCancelled:
+            raise
+        except Exception:
+            return _failed_thumb(size)
+        THUMB_DISK_CACHE.put(path, size, frame)
+        return frame
+
+
+def _failed_thumb(size: tuple[int, int]) -> Image.Image:
+    # Grey stand-in for an unreadable file; flagged so it is never cached
+    im = Image.new("RGB", size, (70, 70, 70))
+    im.info["failed"] = True
+    return im
+
+
+_np = None
+
+
+def _numpy():
+    # numpy, imported on first use, or None when it is not installed
+    global _np
+    if _np is None:
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:
+            _np = False
+    return _np or None
+
+
+def hash_algo() -> str:
+    return "phash" if _numpy() else "dhash"
+
+
+def perceptual_hash(im: Image.Image) -> int:
+    # 64-bit DCT hash (low 8x8 frequencies of a 32x32 grey image against
+    # their median); Pillow-only fallback: difference hash of a 9x8 image
+    np = _numpy()
+    if np is None:
+        px = list(im.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+        bits = 0
+        for y in range(8):
+            for x in range(8):
+                bits = (bits << 1) | (px[y * 9 + x] < px[y * 9 + x + 1])
+        return bits
+    a = np.asarray(im.convert("L").resize((32, 32), Image.BILINEAR),
+                   dtype=np.float64)
+    k = np.arange(32)
+    dct = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / 64)
+    low = (dct @ a @ dct.T)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def dominant_colours(im: Image.Image, k: int = 8) -> list[list]:
+    # Up to k [r, g, b, fraction] entries, most common first. Pixels of a
+    # 64x36 copy are grouped by hue (12 sectors of 30 degrees, at any
+    # brightness) or, when nearly grey, by brightness (4 steps); each group
+    # is reported as the mean of its pixels. Grouping by hue keeps a blue
+    # scene one large blue group instead of many small shades of blue.
+    # Pillow-only fallback: the same grouping one pixel at a time
+    small = im.convert("RGB").resize((64, 36), Image.BILINEAR)
+    np = _numpy()
+    if np is not None:
+        rgb = np.asarray(small, dtype=np.int64).reshape(-1, 3)
+        h, s, v = np.asarray(small.convert("HSV"),
+                             dtype=np.int64).reshape(-1, 3).T
+        keys = np.where((s < 51) | (v < 38), 12 + v // 64,
+                        (h * 12 + 128) // 256 % 12)
+        counts = np.bincount(keys, minlength=16)
+        sums = [np.bincount(keys, weights=rgb[:, c], minlength=16)
+                for c in range(3)]
+        # Groups in order of first appearance, as the loop builds them
+        _, first = np.unique(keys, return_index=True)
+        order = keys[np.sort(first)]
+        groups = {int(key): [int(sums[0][key]), int(sums[1][key]),
+                             int(sums[2][key]), int(counts[key])]
+                  for key in order}
+    else:
+        groups: dict[int, list[int]] = {}
+        for (r, g, b), (h, s, v) in zip(small.getdata(),
+                                        small.convert("HSV").getdata()):
+            if s < 51 or v < 38:
+                key = 12 + v // 64
+            else:
+                key = (h * 12 + 128) // 256 % 12
+            acc = groups.get(key)
+            if acc is None:
+                acc = groups[key] = [0, 0, 0, 0]
+            acc[0] += r
+            acc[1] += g
+            acc[2] += b
+            acc[3] += 1
+    total = small.width * small.height
+    top = sorted(groups.values(), key=lambda a: -a[3])[:k]
+    return [[round(r / n), round(g / n), round(b / n), round(n / total, 3)]
+            for r, g, b, n in top]
+
+
+def image_features(path: Path, im: Optional[Image.Image] = None) -> list:
+    # [hash, colours] from the same reduced thumbnail the grid shows
+    if im is None:
+        im = build_static_thumb_image(path, THUMB_SIZE)
+    return [perceptual_hash(im), dominant_colours(im)]
+
+
+class FeatureIndex:
+    # Persisted perceptual hash and dominant colours per file, next to the
+    # LibraryIndex and invalidated the same way (size, mtime). Hashes from
+    # the numpy and fallback algorithms are not comparable, so the file is
+    # discarded when the algorithm changes.
+    VERSION = 2
+
+    def __init__(self, root: Path):
+        self.root = root
+        key = hashlib.sha1(str(root).encode("utf-8", "surrogateescape"))
+        self.path = (Path(CACHE_DIR).expanduser()
+                     / f"features-{key.hexdigest()[:12]}.json")
+        self.algo = hash_algo()
+        # path -> [size, mtime_ns, hash, colours]
+        self.files: dict[str, list] = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if (data.get("version") != self.VERSION
+                or data.get("algo") != self.algo):
+            return
+        self.files = data.get("files", {})
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {"version": self.VERSION, "algo": self.algo,
+                    "files": dict(self.files)}
+            self.dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(data, separators=(",", ":")))
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def get(self, path: Path, info: Optional[list]) -> Optional[list]:
+        # [hash, colours] if computed for this version of the file
+        rec = self.files.get(str(path))
+        if rec is None or info is None or rec[0] != info[0] or rec[1] != info[1]:
+            return None
+        return rec[2:]
+
+    def put(self, path: Path, info: list, features: list):
+        with self.lock:
+            self.files[str(path)] = [info[0], info[1], *features]
+            self.dirty = True
+
+    def missing(self, files: List[Path], index: LibraryIndex) -> List[Path]:
+        return [p for p in files if self.get(p, index.info(p)) is None]
+
+    def compute(self, paths: List[Path], index: LibraryIndex) -> int:
+        done = 0
+        for p in paths:
+            checkpoint()
+            info = index.info(p)
+            if info is None:
+                continue
+            try:
+                self.put(p, info, image_features(p))
+                done += 1
+            except JobCancelled:
+                raise
+            except Exception:
+                pass
+        return done
+
+    def prune(self, files: List[Path]):
+        keep = {str(p) for p in files}
+        with self.lock:
+            for gone in self.files.keys() - keep:
+                del self.files[gone]
+                self.dirty = True
+
+
+class MultiIndexHash:
+    # Radius queries over 64-bit hashes by multi-index hashing: each hash is
+    # cut into radius + 1 chunks and filed under every chunk's value. Two
+    # hashes within radius bits agree exactly on at least one chunk, so a
+    # query only compares against the hashes sharing one of its buckets.
+    BITS = 64
+
+    def __init__(self, radius: int):
+        self.radius = radius
+        n = max(1, min(radius + 1, self.BITS))
+        bounds = [self.BITS * i // n for i in range(n + 1)]
+        self.chunks = [(lo, (1 << (hi - lo)) - 1)
+                       for lo, hi in zip(bounds, bounds[1:])]
+        self.tables: list[dict[int, list]] = [{} for _ in self.chunks]
+
+    def add(self, h: int, item):
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            table.setdefault((h >> shift) & mask, []).append((h, item))
+
+    def query(self, h: int) -> list:
+        out = []
+        seen = set()
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            for other, item in table.get((h >> shift) & mask, ()):
+                if item not in seen and (other ^ h).bit_count() <= self.radius:
+                    seen.add(item)
+                    out.append(item)
+        return out
+
+
+def duplicate_groups(files: List[Path], features: FeatureIndex,
+                     index: LibraryIndex, radius: int) -> dict[Path, Path]:
+    # Maps every file that has a near-duplicate to its group's
+    # representative: the largest image (by pixels), then the first listed.
+    # Animated files are only grouped with animated ones (a still of a GIF
+    # must never hide the GIF), so each kind gets its own table.
+    tables = {False: MultiIndexHash(radius), True: MultiIndexHash(radius)}
+    hashes: list[int] = []
+    parent = list(range(len(files)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, p in enumerate(files):
+        info = index.info(p)
+        feat = features.get(p, info)
+        if feat is None:
+            continue
+        # Each pair is found once, when its later file is added
+        table = tables[bool(info[4])]
+        for j in table.query(feat[0]):
+            a, b = find(i), find(j)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+        table.add(feat[0], i)
+        hashes.append(i)
+    groups: dict[int, list[int]] = defaultdict(list)
+    for i in hashes:
+        groups[find(i)].append(i)
+
+    def pixels(i: int) -> int:
+        info = index.info(files[i]) or [0, 0, 0, 0]
+        return info[2] * info[3]
+
+    rep: dict[Path, Path] = {}
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        best = max(members, key=lambda i: (pixels(i), -i))
+        for i in members:
+            rep[files[i]] = files[best]
+    return rep
+
+
+def _iter_animation(
+    im: Image.Image, size: tuple[int, int]
+) -> Iterator[tuple[Image.Image, int]]:
+    # Cover-cropped frames of an open animation with their durations, one
+    # at a time. Frames usually change a small area: resample only that
+    # region and reuse the rest of the previous output frame
+    from PIL import ImageSequence
+
+    prev_src: Optional[Image.Image] = None
+    prev_out: Optional[Image.Image] = None
+    prev_extent = None
+    area = im.size[0] * im.size[1]
+    for frame in ImageSequence.Iterator(im):
+        checkpoint()
+        if frame.mode not in ("RGB", "RGBA"):
+            cur = frame.convert("RGBA")
+        else:
+            cur = frame.copy()
+        dur = frame.info.get("duration", im.info.get("duration", 100))
+        if not isinstance(dur, int) or dur <= 0:
+            dur = 100
+        if prev_out is None:
+            out = _resize_cover_16x9(cur, size)
+        else:
+            box = _changed_box(im, prev_src, cur, prev_extent)
+            if box is None:
+                out = prev_out
+            elif (box[2] - box[0]) * (box[3] - box[1]) > area // 2:
+                out = _resize_cover_16x9(cur, size)
+            else:
+                out = _resize_cover_region(cur, size, prev_out, box)
+        yield out, int(dur)
+        prev_src, prev_out = cur, out
+        prev_extent = getattr(im, "dispose_extent", None)
+
+
+def _decode_animation(
+    path: Path, size: tuple[int, int]
+) -> tuple[list[Image.Image], list[int]]:
+    try:
+        im = Image.open(path)
+        is_animated = getattr(im, "is_animated", False)
+        n = getattr(im, "n_frames", 1)
+        if not is_animated or n <= 1:
+            return [build_static_thumb_image(path, size)], [1000]
+        frames: list[Image.Image] = []
+        durs: list[int] = []
+        for out, dur in _iter_animation(im, size):
+            frames.append(out)
+            durs.append(dur)
+        if not frames:
+            return [build_static_thumb_image(path, size)], [1000]
+        return frames, durs
+    except JobCancelled:
+        raise
+    except Exception:
+        return [build_static_thumb_image(path, size)], [1000]
+
+
+# Process backend: workers return raw RGB buffers, which are cheap to pickle
+# and are wrapped back into PIL images in the calling thread
+_decode_pool: Optional[ProcessPoolExecutor] = None
+_decode_pool_lock = threading.Lock()
+
+
+def _get_decode_pool() -> ProcessPoolExecutor:
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            # spawn: forking a process that already runs Tk threads is unsafe
+            _decode_pool = ProcessPoolExecutor(
+                max_workers=DECODE_PROCS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _decode_pool
+
+
+def shutdown_decode_pool():
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is not None:
+            # Waits only for decodes already running; call after the window
+            # is gone so closing never blocks on it
+            _decode_pool.shutdown(wait=True, cancel_futures=True)
+            _decode_pool = None
+
+
+def _raw_static_thumb(path: Path, size: tuple[int, int]) -> bytes:
+    im = build_static_thumb_image(path, size)
+    return b"" if im.info.get("failed") else im.convert("RGB").tobytes()
+
+
+def decode_static_thumb(path: Path, size: tuple[int, int]) -> Image.Image:
+    # Atlas, then the cache service, then the JPEG cache or a decode; what
+    # the atlas misses is added to it
+    im = THUMB_ATLAS.get(path, size)
+    if im is not None:
+        return im
+    im = SERVICE.thumb(path, size)
+    if im is None and DECODE_BACKEND != "process":
+        im = build_static_thumb_image(path, size)
+    elif im is None:
+        raw = _get_decode_pool().submit(_raw_static_thumb, path, size).result()
+        im = Image.frombytes("RGB", size, raw) if raw else _failed_thumb(size)
+    if not im.info.get("failed"):
+        THUMB_ATLAS.put(path, size, im)
+    return im
+
+
+class FrameStore:
+    # An animation's frames packed into one contiguous buffer: 1 byte per
+    # pixel against a shared palette for GIF sources, RGB otherwise, with
+    # transparency flattened onto the widget background. A cached GIF costs
+    # about a quarter of the RGBA PhotoImages it replaces; frames are turned
+    # into images only when a player is about to show them. rects[i] is the
+    # box that changed from frame i - 1 (cyclically) to frame i, or None.
+    __slots__ = ("size", "mode", "palette", "buf", "durations", "rects")
+
+    def __init__(self, size: tuple[int, int], mode: str,
+                 palette: Optional[bytes], buf: bytes, durations: list[int],
+                 rects: list[Optional[tuple[int, int, int, int]]]):
+        self.size = size
+        self.mode = mode
+        self.palette = palette
+        self.buf = buf
+        self.durations = durations
+        self.rects = rects
+
+    @classmethod
+    def pack(cls, frames: list[Image.Image], durs: list[int], bg: str,
+             use_palette: bool) -> "FrameStore":
+        size = frames[0].size
+        flat = []
+        for f in frames:
+            if f.mode == "RGBA":
+                base = Image.new("RGB", f.size, bg)
+                base.paste(f, mask=f.getchannel("A"))
+                f = base
+            elif f.mode != "RGB":
+                f = f.convert("RGB")
+            flat.append(f)
+        # Diffed before quantizing: equal colours map to equal indices
+        from PIL import ImageChops
+
+        rects = []
+        for i, f in enumerate(flat):
+            prev = flat[i - 1]
+            if len(flat) == 1 or prev is f:
+                rects.append(None)
+            else:
+                rects.append(ImageChops.difference(prev, f).getbbox())
+        palette = None
+        if use_palette:
+            pal = cls._shared_palette(flat)
+            flat = [f.quantize(palette=pal, dither=Image.Dither.NONE)
+                    for f in flat]
+            palette = bytes(pal.getpalette()[:768])
+        mode = "P" if use_palette else "RGB"
+        return cls(size, mode, palette, b"".join(f.tobytes() for f in flat),
+                   list(durs), rects)
+
+    @staticmethod
+    def _shared_palette(frames: list[Image.Image]) -> Image.Image:
+        # One palette for all frames, from a strip of downscaled samples
+        step = max(1, len(frames) // 8)
+        samples = frames[::step][:8]
+        w = 96
+        h = max(1, round(w * frames[0].height / max(1, frames[0].width)))
+        strip = Image.new("RGB", (w * len(samples), h))
+        for i, f in enumerate(samples):
+            strip.paste(f.resize((w, h), Image.BILINEAR), (i * w, 0))
+        return strip.quantize(256, method=Image.Quantize.MEDIANCUT)
+
+    def __len__(self) -> int:
+        return len(self.durations)
+
+    def changed(self, shown: int, target: int
+                ) -> Optional[tuple[int, int, int, int]]:
+        # Box that must be repainted to go from frame `shown` to `target`
+        n = len(self.rects)
+        x0 = y0 = 1 << 30
+        x1 = y1 = -1
+        i = shown
+        while i != target:
+            i = (i + 1) % n
+            r = self.rects[i]
+            if r is None:
+                continue
+            x0, y0 = min(x0, r[0]), min(y0, r[1])
+            x1, y1 = max(x1, r[2]), max(y1, r[3])
+        if x1 < 0:
+            return None
+        return (x0, y0, x1, y1)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.buf) + (len(self.palette) if self.palette else 0)
+
+    def image(self, i: int) -> Image.Image:
+        w, h = self.size
+        n = w * h * (1 if self.mode == "P" else 3)
+        view = memoryview(self.buf)[i * n:(i + 1) * n]
+        im = Image.frombuffer(self.mode, self.size, view, "raw", self.mode, 0, 1)
+        if self.palette is not None:
+            im.putpalette(self.palette)
+        return im
+
+
+def _packed_animation(path: Path, size: tuple[int, int], bg: str) -> FrameStore:
+    frames, durs = _decode_animation(path, size)
+    return FrameStore.pack(frames, durs, bg, path.suffix.lower() == ".gif")
+
+
+def load_animation_store(
+    path: Path, size: tuple[int, int], bg: str
+) -> FrameStore:
+    # Packing happens in the worker; with the process backend only the
+    # packed buffer crosses the process boundary
+    with PROFILER.span("anim.load", size=f"{size[0]}x{size[1]}") as info:
+        # Mapped from the cache service when one is running
+        store = SERVICE.animation(path, size, bg)
+        info["service"] = store is not None
+        if store is None and DECODE_BACKEND != "process":
+            store = _packed_animation(path, size, bg)
+        elif store is None:
+            store = _get_decode_pool().submit(
+                _packed_animation, path, size, bg).result()
+        info["frames"] = len(store)
+        info["bytes"] = store.nbytes
+        return store
+
+
+# Cache service
+def _private_dir(path: str) -> bool:
+    # A directory of ours that nobody else can write to, so nothing in it
+    # was planted by another user
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid()
+            and not st.st_mode & 0o077)
+
+
+class CacheClient:
+    # Talks to a running `picker.py serve` over CACHE_SOCKET: one JSON line
+    # per request and per reply, one connection per thread. Methods return
+    # None when the service is absent, refuses or fails, and callers then
+    # decode in-process. Buffers are mapped read-only from SHARED_DIR; the
+    # service may unlink them at any time without affecting the mapping.
+    def __init__(self, path: str):
+        self.path = path
+        self.enabled = True
+        self.local = threading.local()
+        self.retry_at = 0.0
+        self.trusted = False
+
+    def _trust(self) -> bool:
+        # Checked until it passes: the service may start after us
+        if not self.trusted:
+            try:
+                owner = os.lstat(self.path).st_uid
+            except OSError:
+                return False
+            self.trusted = (owner == os.getuid()
+                            and _private_dir(os.path.dirname(self.path))
+                            and _private_dir(SHARED_DIR))
+        return self.trusted
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            import socket
+
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(SERVICE_TIMEOUT)
+            try:
+                conn.connect(self.path)
+            except OSError:
+                conn.close()
+                raise
+            self.local.conn = conn
+            self.local.reader = conn.makefile("rb")
+        return conn
+
+    def _drop(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            self.local.reader.close()
+            conn.close()
+        self.local.conn = None
+
+    def request(self, op: str, **args) -> Optional[dict]:
+        if (not self.enabled or time.monotonic() < self.retry_at
+                or not self._trust()):
+            return None
+        try:
+            conn = self._conn()
+            conn.sendall(json.dumps({"op": op, **args}).encode() + b"\n")
+            line = self.local.reader.readline()
+            if not line:
+                raise OSError("connection closed")
+            reply = json.loads(line)
+        except (OSError, ValueError):
+            self._drop()
+            self.retry_at = time.monotonic() + SERVICE_RETRY_S
+            return None
+        return None if "error" in reply else reply
+
+    @staticmethod
+    def _map(name: str):
+        import mmap
+
+        with open(os.path.join(SHARED_DIR, name), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+
+    def files(self, root: Path) -> Optional[List[Path]]:
+        # The service saves its index after every refresh, so a
+        # LibraryIndex loaded afterwards matches this list
+        reply = self.request("files", root=str(root))
+        return None if reply is None else [Path(p) for p in reply["files"]]
+
+    def thumb(self, path: Path, size: tuple[int, int]) -> Optional[Image.Image]:
+        reply = self.request("thumb", path=str(path), size=list(size))
+        if reply is None:
+            return None
+        try:
+            with self._map(reply["name"]) as mm:
+                im = Image.frombytes("RGB", tuple(reply["size"]), mm)
+        except (OSError, ValueError):
+            return None  # evicted between reply and open
+        if reply.get("failed"):
+            im.info["failed"] = True
+        return im
+
+    def animation(self, path: Path, size: tuple[int, int],
+                  bg: str) -> Optional[FrameStore]:
+        reply = self.request("anim", path=str(path), size=list(size), bg=bg)
+        if reply is None:
+            return None
+        try:
+            buf = self._map(reply["name"])
+        except (OSError, ValueError):
+            return None
+        palette = bytes.fromhex(reply["palette"]) if reply["palette"] else None
+        rects = [tuple(r) if r else None for r in reply["rects"]]
+        return FrameStore(tuple(reply["size"]), reply["mode"], palette, buf,
+                          reply["durations"], rects)
+
+
+SERVICE = CacheClient(CACHE_SOCKET)
+
+
+class CacheService:
+    # `picker.py serve`. Owns the LibraryIndex of WALL_DIR (refreshed when
+    # the file list is asked for, at most once a second) and the buffers in
+    # SHARED_DIR, named by file, size and version and evicted least
+    # recently used first beyond SHARED_CACHE_MB. Concurrent requests for a
+    # buffer being built wait for that build. Each client connection gets
+    # a thread; decodes go through the usual backend.
+    SCAN_INTERVAL_S = 1.0
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.index = LibraryIndex(root)
+        self.files: List[Path] = []
+        self.scanned = 0.0
+        self.scan_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, tuple[dict, int]] = OrderedDict()
+        self.pending: dict[str, Future] = {}
+        self.bytes = 0
+        self.max_bytes = SHARED_CACHE_MB * 1024 * 1024
+        self.dir = Path(SHARED_DIR)
+        self.dir.mkdir(parents=True, exist_ok=True, mode=0o700)
+        for stale in self.dir.iterdir():  # left by an earlier run
+            stale.unlink(missing_ok=True)
+        self.scan()
+
+    def scan(self) -> List[Path]:
+        with self.scan_lock:
+            if time.monotonic() - self.scanned >= self.SCAN_INTERVAL_S:
+                files = self.index.refresh() if self.root.exists() else []
+                self.index.save()
+                self.scanned = time.monotonic()
+                if files != self.files:
+                    THUMB_ATLAS.prune(files)
+                self.files = files
+            return self.files
+
+    def _key(self, kind: str, path: Path, size, extra: str = "") -> Optional[str]:
+        info = self.index.info(path)
+        if info is None:
+            return None
+        raw = f"{path}\0{info[0]}\0{info[1]}\0{size[0]}x{size[1]}\0{extra}"
+        digest = hashlib.sha1(raw.encode("utf-8", "surrogateescape"))
+        return f"{kind}-{digest.hexdigest()[:24]}"
+
+    def _get(self, key: str, build) -> dict:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[0]
+            fut = self.pending.get(key)
+            owner = fut is None
+            if owner:
+                fut = self.pending[key] = Future()
+        if not owner:
+            return fut.result()
+        try:
+            reply, data = build()
+            reply["name"] = key
+            tmp = self.dir / f".{key}.tmp"
+            tmp.write_bytes(data)
+            os.replace(tmp, self.dir / key)
+            with self.lock:
+                self.entries[key] = (reply, len(data))
+                self.bytes += len(data)
+                self._evict()
+            fut.set_result(reply)
+            return reply
+        except BaseException as exc:
+            fut.set_exception(exc)
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            key, (_, n) = self.entries.popitem(last=False)
+            self.bytes -= n
+            (self.dir / key).unlink(missing_ok=True)
+
+    def thumb(self, path: Path, size: tuple[int, int]) -> dict:
+        key = self._key("t", path, size)
+        if key is None:
+            return {"error": "not in the library"}
+
+        def build():
+            im = decode_static_thumb(path, size)
+            failed = bool(im.info.get("failed"))
+            if im.mode != "RGB":
+                im = im.convert("RGB")
+            return {"size": list(im.size), "failed": failed}, im.tobytes()
+
+        return self._get(key, build)
+
+    def animation(self, path: Path, size: tuple[int, int], bg: str) -> dict:
+        key = self._key("a", path, size, bg)
+        if key is None:
+            return {"error": "not in the library"}
+        if not fits_whole(max(1, self.index.info(path)[5]), size):
+            return {"error": f"larger than STREAM_FULL_MB at {list(size)}"}
+
+        def build():
+            store = load_animation_store(path, size, bg)
+            reply = {"size": list(store.size), "mode": store.mode,
+                     "palette": store.palette.hex() if store.palette else None,
+                     "durations": store.durations, "rects": store.rects}
+            return reply, store.buf
+
+        return self._get(key, build)
+
+    @staticmethod
+    def _size(req: dict, animated: bool) -> tuple[int, int]:
+        # Only sizes a picker asks for; anything else would let one request
+        # allocate an arbitrary buffer
+        size = tuple(req["size"])
+        if size == THUMB_SIZE:
+            return size
+        max_w, max_h = preview_bucket(SHARED_MAX_PREVIEW)
+        if (animated and len(size) == 2
+                and all(type(v) is int and v > 0 for v in size)
+                and size[0] <= max_w and size[1] <= max_h
+                and preview_bucket(size) == size):
+            return size
+        raise ValueError(f"unsupported size {list(size)}")
+
+    def handle(self, req: dict) -> dict:
+        op = req.get("op")
+        try:
+            if op == "files":
+                if req.get("root") != str(self.root):
+                    return {"error": f"serving {self.root}"}
+                return {"files": [str(p) for p in self.scan()]}
+            if op == "thumb":
+                return self.thumb(Path(req["path"]), self._size(req, False))
+            if op == "anim":
+                return self.animation(Path(req["path"]), self._size(req, True),
+                                      req.get("bg", COL_BG))
+            if op == "stats":
+                with self.lock:
+                    return {"pid": os.getpid(), "files": len(self.files),
+                            "entries": len(self.entries), "bytes": self.bytes}
+        except (KeyError, TypeError, ValueError) as exc:
+            return {"error": f"bad request: {exc}"}
+        except Exception as exc:
+            return {"error": str(exc)}
+        return {"error": f"unknown op {op!r}"}
+
+    def serve_forever(self, path: str):
+        import socketserver
+
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        reply = service.handle(json.loads(line))
+                    except ValueError:
+                        reply = {"error": "bad request"}
+                    self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+        old = os.umask(0o077)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        finally:
+            os.umask(old)
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            for f in self.dir.iterdir():
+                f.unlink(missing_ok=True)
+
+
+def _swww_socket() -> Optional[Path]:
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime:
+        return None
+    display = os.environ.get("WAYLAND_DISPLAY")
+    for name in (f"swww-{display}.socket" if display else None, "swww.socket"):
+        if name and (Path(runtime) / name).exists():
+            return Path(runtime) / name
+    return None
+
+
+def ensure_swww_ready() -> bool:
+    # The daemon's socket existing is enough; only fork swww query/init when
+    # it is missing
+    if _swww_socket() is not None:
+        return True
+    try:
+        subprocess.run(
+            ["swww", "query"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            timeout=SWWW_TIMEOUT,
+        )
+        return True
+    except Exception:
+        try:
+            subprocess.run(["swww", "init"], check=True, timeout=SWWW_TIMEOUT)
+            return True
+        except (subprocess.SubprocessError, OSError):
+            return False
+
+
+def get_monitors() -> list[tuple[str, tuple[int, int]]]:
+    # (output name, pixel size) for each connected monitor, via hyprctl
+    try:
+        out = subprocess.run(
+            ["hyprctl", "monitors", "-j"],
+            capture_output=True, text=True, check=True, timeout=2,
+        ).stdout
+        monitors = []
+        for m in json.loads(out):
+            w, h = int(m["width"]), int(m["height"])
+            if int(m.get("transform", 0)) % 2:
+                w, h = h, w
+            monitors.append((m["name"], (w, h)))
+        return monitors
+    except Exception:
+        return []
+
+
+class VariantCache:
+    # Monitor-resolution renders of wallpapers, content-addressed (sha256 of
+    # the source) so renamed or duplicated files share variants. Source
+    # hashes are memoised by (path, mtime, size) in hashes.json. Entries are
+    # evicted oldest-mtime first past max_bytes; lookups touch them.
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hashes: Optional[dict[str, list]] = None
+
+    def _load_hashes(self) -> dict[str, list]:
+        if self.hashes is None:
+            try:
+                self.hashes = json.loads((self.root / "hashes.json").read_text())
+            except (OSError, ValueError):
+                self.hashes = {}
+        return self.hashes
+
+    def digest(self, path: Path) -> Optional[str]:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        with self.lock:
+            rec = self._load_hashes().get(str(path))
+        if rec and rec[0] == st.st_mtime_ns and rec[1] == st.st_size:
+            return rec[2]
+        h = hashlib.sha256()
+        try:
+            with open(path, "rb") as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b""):
+                    h.update(chunk)
+        except OSError:
+            return None
+        digest = h.hexdigest()
+        with self.lock:
+            hashes = self._load_hashes()
+            hashes[str(path)] = [st.st_mtime_ns, st.st_size, digest]
+            try:
+                self.root.mkdir(parents=True, exist_ok=True)
+                tmp = (self.root
+                       / f"hashes.{os.getpid()}-{threading.get_ident()}.tmp")
+                tmp.write_text(json.dumps(hashes))
+                os.replace(tmp, self.root / "hashes.json")
+            except OSError:
+                pass
+        return digest
+
+    @staticmethod
+    def _is_gif_animation(path: Path) -> bool:
+        if path.suffix.lower() != ".gif":
+            return False
+        try:
+            with Image.open(path) as im:
+                return bool(getattr(im, "is_animated", False))
+        except Exception:
+            return False
+
+    @staticmethod
+    def _write_gif(dest: Path, frames: Iterator[tuple[Image.Image, int]]):
+        # Frame by frame, each with its own palette: Pillow's save_all keeps
+        # every frame until the end, gigabytes for a long GIF at 4K
+        from PIL import GifImagePlugin
+
+        with open(dest, "wb") as fh:
+            first = True
+            for frame, dur in frames:
+                im = frame.convert("RGB").quantize(
+                    256, method=Image.Quantize.FASTOCTREE)
+                if first:
+                    header, _ = GifImagePlugin.getheader(
+                        im, info={"loop": 0, "duration": dur})
+                    fh.writelines(header)
+                fh.writelines(GifImagePlugin.getdata(
+                    im, duration=dur, include_color_table=not first))
+                first = False
+            if first:
+                raise ValueError("no frames")
+            fh.write(b";")
+
+    def _variant_path(self, digest: str, size: tuple[int, int],
+                      animated: bool) -> Path:
+        ext = "gif" if animated else "jpg"
+        return self.root / digest[:2] / f"{digest}-{size[0]}x{size[1]}.{ext}"
+
+    def lookup(self, path: Path, size: tuple[int, int]) -> Optional[Path]:
+        digest = self.digest(path)
+        if digest is None:
+            return None
+        for animated in (False, True):
+            v = self._variant_path(digest, size, animated)
+            if v.exists():
+                try:
+                    os.utime(v)
+                except OSError:
+                    pass
+                return v
+        return None
+
+    def render(self, path: Path, size: tuple[int, int]) -> Optional[Path]:
+        existing = self.lookup(path, size)
+        if existing is not None:
+            return existing
+        digest = self.digest(path)
+        if digest is None:
+            return None
+        animated = self._is_gif_animation(path)
+        if not animated and path.suffix.lower() in (".gif", ".webp"):
+            try:
+                with Image.open(path) as im:
+                    if getattr(im, "is_animated", False):
+                        # Animated WebP: swww gets the original
+                        return None
+            except Exception:
+                return None
+        out = self._variant_path(digest, size, animated)
+        tmp = out.with_name(
+            f".{out.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        try:
+            out.parent.mkdir(parents=True, exist_ok=True)
+            if animated:
+                with Image.open(path) as src:
+                    self._write_gif(tmp, _iter_animation(src, size))
+            else:
+                im = _open_reduced(path, size)
+                if im.mode not in ("RGB", "RGBA"):
+                    im = im.convert("RGB")
+                _resize_cover_16x9(im, size).save(tmp, "JPEG", quality=95)
+            os.replace(tmp, out)
+        except JobCancelled:
+            tmp.unlink(missing_ok=True)
+            raise
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            return None
+        self.prune()
+        return out
+
+    def prune(self):
+        with self.lock:
+            entries = []
+            for p in self.root.glob("*/*-*x*.*"):
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+            total = sum(sz for _, sz, _ in entries)
+            for _, sz, p in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                p.unlink(missing_ok=True)
+                total -= sz
+
+
+VARIANTS = VariantCache(
+    Path(CACHE_DIR).expanduser() / "variants", VARIANT_CACHE_MB * 1024 * 1024
+)
+
+
+def _history_file() -> Path:
+    return Path(CACHE_DIR).expanduser() / "history"
+
+
+def record_history(path: Path):
+    hist = [p for p in recent_wallpapers() if p != path]
+    hist.insert(0, path)
+    try:
+        _history_file().parent.mkdir(parents=True, exist_ok=True)
+        _history_file().write_text(
+            "\n".join(str(p) for p in hist[:HISTORY_LEN]) + "\n")
+    except OSError:
+        pass
+
+
+def recent_wallpapers() -> list[Path]:
+    try:
+        lines = _history_file().read_text().splitlines()
+    except OSError:
+        return []
+    return [Path(line) for line in lines if line.strip()]
+
+
+def favourite_wallpapers() -> list[Path]:
+    try:
+        lines = Path(FAVORITES_FILE).expanduser().read_text().splitlines()
+    except OSError:
+        return []
+    return [Path(line.strip()).expanduser() for line in lines
+            if line.strip() and not line.startswith("#")]
+
+
+def prerender_wanted() -> list[Path]:
+    # Recently used and favourite wallpapers, once each
+    paths = dict.fromkeys([*recent_wallpapers(), *favourite_wallpapers()])
+    return [p for p in paths if p.is_file()]
+
+
+def prerender_variants(paths: list[Path], monitors=None):
+    if monitors is None:
+        monitors = get_monitors()
+    for p in paths:
+        for _, size in monitors:
+            checkpoint()
+            VARIANTS.render(p, size)
+
+
+def _swww_targets(path: Path) -> list[tuple[Optional[str], Path]]:
+    # One (output, file) pair per monitor, using a cached variant where one
+    # exists; missing variants are rendered by a detached helper process so
+    # the next apply of this wallpaper is fast
+    if not PRERENDER:
+        return [(None, path)]
+    monitors = get_monitors()
+    if not monitors:
+        return [(None, path)]
+    targets = []
+    missing = False
+    for name, size in monitors:
+        variant = VARIANTS.lookup(path, size)
+        missing = missing or variant is None
+        targets.append((name, variant or path))
+    if missing:
+        try:
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "prerender",
+                 str(path)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError:
+            pass
+    return targets
+
+
+def set_wallpaper(path: Path) -> tuple[bool, str]:
+    if not ensure_swww_ready():
+        return False, "swww daemon is not running"
+    procs = []
+    for output, file in _swww_targets(path):
+        cmd = ["swww", "img", str(file), *SWWW_ARGS]
+        if output is not None:
+            cmd += ["--outputs", output]
+        try:
+            procs.append(subprocess.Popen(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                text=True))
+        except OSError as e:
+            return False, str(e)
+    errors = []
+    deadline = time.monotonic() + SWWW_TIMEOUT
+    for p in procs:
+        try:
+            _, err = p.communicate(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.communicate()
+            errors.append(f"swww img timed out after {SWWW_TIMEOUT:g}s")
+            continue
+        if p.returncode != 0:
+            errors.append(err.strip() or f"swww img exited {p.returncode}")
+    if errors:
+        return False, "; ".join(errors)
+    Path(LAST_FILE).parent.mkdir(parents=True, exist_ok=True)
+    Path(LAST_FILE).write_text(str(path))
+    record_history(path)
+    return True, ""
+
+
+class WallpaperSetter:
+    # Applies wallpapers on a background thread so callers never block on
+    # swww. Requests coalesce: while one apply runs, later ones overwrite a
+    # single pending slot and only the newest is applied next. on_done(path,
+    # ok, error) runs on the setter thread.
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending: Optional[tuple[Path, Optional[object]]] = None
+        self.busy = False
+        self.thread: Optional[threading.Thread] = None
+
+    def apply(self, path: Path, on_done=None):
+        with self.cond:
+            self.pending = (path, on_done)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def idle(self) -> bool:
+        with self.cond:
+            return self.pending is None and not self.busy
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        with self.cond:
+            return self.cond.wait_for(
+                lambda: self.pending is None and not self.busy, timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending is not None)
+                (path, on_done), self.pending = self.pending, None
+                self.busy = True
+            with PROFILER.span("swww.apply", path=path.name):
+                try:
+                    ok, err = set_wallpaper(path)
+                except Exception as e:
+                    ok, err = False, str(e)
+            if not ok:
+                print(f"Failed to set {path}: {err}", file=sys.stderr)
+            if on_done is not None:
+                try:
+                    on_done(path, ok, err)
+                except Exception:
+                    pass
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+
+
+WALLPAPER_SETTER = WallpaperSetter()
+
+
+AnimKey = tuple[Path, tuple[int, int]]
+
+
+class AnimCache:
+    # LRU of packed animations (FrameStore), key = (path, size), bounded by
+    # their buffer sizes. Keys reported by `pinned` (the open preview, bound
+    # tiles) are never evicted.
+    def __init__(self, max_bytes: int, pinned):
+        self.max_bytes = max_bytes
+        self.pinned = pinned
+        self.entries: OrderedDict[AnimKey, FrameStore] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: AnimKey) -> bool:
+        return key in self.entries
+
+    def get(self, key: AnimKey) -> Optional[FrameStore]:
+        store = self.entries.get(key)
+        if store is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return store
+
+    def put(self, key: AnimKey, store: FrameStore):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old.nbytes
+        self.entries[key] = store
+        self.bytes += store.nbytes
+        self._evict()
+
+    def _evict(self):
+        if self.bytes <= self.max_bytes:
+            return
+        pinned = self.pinned()
+        for key in list(self.entries):
+            if self.bytes <= self.max_bytes:
+                break
+            if key in pinned:
+                continue
+            self.bytes -= self.entries.pop(key).nbytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
 
-def find_images(dir_path: Path) -> List[Path]:
-    if not dir_path.exists():
-        return []
-    out: List[Path] = []
-    for p in sorted(dir_path.rglob("*")):
-        if p.is_file() and p.suffix.lower() in SUPPORTED_EXT:
-            out.append(p)
-    return out
+class AnimStream:
+    # Decodes an animation incrementally as PRIO_PREVIEW jobs on the
+    # scheduler. The player asks for frames by sequence number (monotonic
+    # across loops). Animations that fit STREAM_FULL_MB are kept whole,
+    # packed into a FrameStore once fully decoded and handed to on_complete
+    # (on the Tk thread) for caching. Windowed streams live as long as the
+    # preview, so rather than pin a worker the job returns once it is
+    # STREAM_AHEAD frames ahead and frame() submits the next one.
+    def __init__(self, path: Path, size: tuple[int, int], bg: str,
+                 scheduler: WorkScheduler, on_complete=None):
+        self.path = path
+        self.size = size
+        self.bg = bg
+        self.scheduler = scheduler
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+        self.decoded: dict[int, tuple[Image.Image, int]] = {}
+        self.store: Optional[FrameStore] = None
+        self.n_frames: Optional[int] = None
+        self.windowed = False
+        self.playhead = 0
+        self.failed = False
+        self.closed = False
+        self.im: Optional[Image.Image] = None
+        self.seq = 0
+        self.parked = False
+        self.job = self._submit()
 
+    def _submit(self) -> Job:
+        return self.scheduler.submit("job.preview_stream", self._run,
+                                     priority=PRIO_PREVIEW)
 
-def _resize_cover_16x9(im: Image.Image, size: tuple[int, int]) -> Image.Image:
-    # Scale to fill and center-crop to exactly the requested size, preserving aspect
-    target_w, target_h = size
-    im2 = im.copy()
-    if im2.mode not in ("RGB", "RGBA"):
-        im2 = im2.convert("RGB")
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.job.cancel()
 
-    src_w, src_h = im2.size
-    # Compute scale to cover the target box
-    scale = max(target_w / src_w, target_h / src_h)
-    new_w, new_h = int(round(src_w * scale)), int(round(src_h * scale))
-    im2 = im2.resize((new_w, new_h), RESAMPLE)
+    def _run(self):
+        try:
+            if self.im is None:
+                self.im = Image.open(self.path)
+                n = max(1, getattr(self.im, "n_frames", 1))
+                with self.lock:
+                    self.n_frames = n
+                    self.windowed = not fits_whole(n, self.size)
+            im, n, windowed = self.im, self.n_frames, self.windowed
+            while windowed or self.seq < n:
+                seq = self.seq
+                with self.lock:
+                    if self.closed:
+                        return
+                    # Full mode decodes straight through; windowed mode stays
+                    # at most STREAM_AHEAD frames ahead of the playhead
+                    if windowed and seq - self.playhead >= STREAM_AHEAD:
+                        self.parked = True
+                        return
+                im.seek(seq % n)
+                frame = im
+                if frame.mode not in ("RGB", "RGBA"):
+                    frame = frame.convert("RGBA")
+                dur = frame.info.get("duration", im.info.get("duration", 100))
+                if not isinstance(dur, int) or dur <= 0:
+                    dur = 100
+                out = _resize_cover_16x9(frame, self.size)
+                with self.lock:
+                    self.decoded[seq if windowed else seq % n] = (out, dur)
+                self.seq = seq + 1
+            with PROFILER.span("anim.pack", frames=n):
+                frames = [self.decoded[i][0] for i in range(n)]
+                durs = [self.decoded[i][1] for i in range(n)]
+                store = FrameStore.pack(frames, durs, self.bg,
+                                        self.path.suffix.lower() == ".gif")
+            with self.lock:
+                self.store = store
+                self.decoded.clear()
+        except Exception:
+            with self.lock:
+                self.failed = True
 
-    # Center-crop to target size
-    left = max(0, (new_w - target_w) // 2)
-    top = max(0, (new_h - target_h) // 2)
-    im2 = im2.crop((left, top, left + target_w, top + target_h))
+    def frame(self, seq: int) -> Optional[tuple[Image.Image, int]]:
+        with self.lock:
+            n = self.n_frames
+            if n is None:
+                return None
+            store = self.store
+            if store is None and not self.windowed:
+                # Kept until the whole animation is packed
+                return self.decoded.get(seq % n)
+            if store is None:
+                item = self.decoded.pop(seq, None)
+                if item is None:
+                    return None
+                self.playhead = seq
+                for stale in [k for k in self.decoded if k < seq]:
+                    del self.decoded[stale]
+                resume = self.parked and not self.closed
+                self.parked = False
+        if store is not None:
+            return store.image(seq % n), store.durations[seq % n]
+        if resume:
+            self.job = self._submit()
+        return item
 
-    # If RGBA, composite onto a solid background to avoid Tk transparency issues
-    if im2.mode == "RGBA":
-        bg = Image.new("RGB", (target_w, target_h), (43, 43, 43))
-        bg.paste(im2, (0, 0), im2)
-        return bg
-    return im2
+    def packed(self) -> Optional[FrameStore]:
+        # The whole animation once packed (full mode only); the first call
+        # hands it to on_complete
+        with self.lock:
+            store = self.store
+        if store is not None and self.on_complete is not None:
+            self.on_complete(store)
+            self.on_complete = None
+        return store
 
 
-def build_static_thumb(path: Path, size: tuple[int, int]) -> ImageTk.PhotoImage:
-    try:
-        im = Image.open(path)
-        if im.mode not in ("RGB", "RGBA"):
-            im = im.convert("RGB")
-        frame = _resize_cover_16x9(im, size)
-    except Exception:
-        frame = Image.new("RGB", size, (70, 70, 70))
-    return ImageTk.PhotoImage(frame)
+class QualityController:
+    # Picks a quality level from how expensive and how late the animation
+    # ticks are (see ADAPTIVE). Level 0 is full quality, levels 1..n cap
+    # tile animations at QUALITY_TILE_FPS[level - 1], the last level leaves
+    # only the focused tile animating. on_change(level) runs on the Tk thread.
+    ALPHA = 0.1
 
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.level = 0
+        self.max_level = len(QUALITY_TILE_FPS) + 1
+        self.load_ms = 0.0
+        self.calm_since: Optional[float] = None
+        self.changed_at = 0.0
+        self.changes = 0
+        self.peak_level = 0
 
-def load_animation_frames(
-    path: Path, size: tuple[int, int]
-) -> tuple[list[ImageTk.PhotoImage], list[int]]:
-    try:
-        im = Image.open(path)
-        is_animated = getattr(im, "is_animated", False)
-        n = getattr(im, "n_frames", 1)
-        if not is_animated or n <= 1:
-            frame = build_static_thumb(path, size)
-            return [frame], [1000]
-        frames: list[ImageTk.PhotoImage] = []
-        durs: list[int] = []
-        for frame in ImageSequence.Iterator(im):
-            if frame.mode not in ("RGB", "RGBA"):
-                frame = frame.convert("RGBA")
-            dur = frame.info.get("duration", im.info.get("duration", 100))
-            if not isinstance(dur, int) or dur <= 0:
-                dur = 100
-            framed = _resize_cover_16x9(frame, size)
-            frames.append(ImageTk.PhotoImage(framed))
-            durs.append(int(dur))
-        if not frames:
-            frame = build_static_thumb(path, size)
-            return [frame], [1000]
-        return frames, durs
-    except Exception:
-        frame = build_static_thumb(path, size)
-        return [frame], [1000]
+    @property
+    def tile_interval(self) -> float:
+        if 0 < self.level <= len(QUALITY_TILE_FPS):
+            return 1 / max(0.1, QUALITY_TILE_FPS[self.level - 1])
+        return 0.0
 
+    @property
+    def focus_only(self) -> bool:
+        return self.level >= self.max_level
 
-def ensure_swww_ready() -> bool:
-    try:
-        subprocess.run(
-            ["swww", "query"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            check=True,
-        )
-        return True
-    except Exception:
-        try:
-            subprocess.run(["swww", "init"], check=True)
-            return True
-        except subprocess.CalledProcessError:
-            return False
+    def sample(self, work_s: float, late_s: float, now: float):
+        ms = (work_s + max(0.0, late_s)) * 1000
+        self.load_ms += self.ALPHA * (ms - self.load_ms)
+        # Give each step time to take effect before judging it
+        if now - self.changed_at < 0.5:
+            return
+        if self.load_ms > QUALITY_BUSY_MS and self.level < self.max_level:
+            self._set(self.level + 1, now)
+        elif self.load_ms < QUALITY_IDLE_MS and self.level > 0:
+            if self.calm_since is None:
+                self.calm_since = now
+            elif now - self.calm_since >= QUALITY_RESTORE_S:
+                self._set(self.level - 1, now)
+        else:
+            self.calm_since = None
 
+    def _set(self, level: int, now: float):
+        self.level = level
+        self.peak_level = max(self.peak_level, level)
+        self.changed_at = now
+        self.calm_since = None
+        self.changes += 1
+        if PROFILER.enabled:
+            PROFILER.record("quality.level", PROFILER._now_us(), 0,
+                            level=level, load_ms=round(self.load_ms, 2))
+        if self.on_change is not None:
+            self.on_change(level)
 
-def set_wallpaper(path: Path) -> bool:
-    if not ensure_swww_ready():
-        return False
-    cmd = ["swww", "img", str(path), *SWWW_ARGS]
-    try:
-        subprocess.run(cmd, check=True)
-        Path(LAST_FILE).parent.mkdir(parents=True, exist_ok=True)
-        Path(LAST_FILE).write_text(str(path))
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    def stats(self) -> dict:
+        return {"level": self.level, "peak_level": self.peak_level,
+                "changes": self.changes, "load_ms": round(self.load_ms, 2)}
 
 
-class TileAnim:
-    def __init__(self, label: tk.Label):
-        self.label = label
-        self.frames: list[ImageTk.PhotoImage] = []
-        self.durations: list[int] = []
-        self.idx = 0
+class AnimScheduler:
+    # Single timer for every AnimPlayer. Each tick advances the
+    # players whose next frame is due and that `visible` accepts, oldest
+    # deadline first, so all image swaps of a tick land in one redraw.
+    # With a QualityController, tick cost and lateness are fed to it and
+    # tile players are held to its frame interval; their deadlines keep
+    # running, so held frames are skipped rather than slowing playback.
+    def __init__(self, widget: tk.Misc, visible,
+                 quality: Optional[QualityController] = None):
+        self.widget = widget
+        self.visible = visible
+        self.quality = quality
+        self.players: set = set()
         self.job: Optional[str] = None
-        self.active = False
-
-    def set_frames(
-        self, frames: list[ImageTk.PhotoImage], durations: list[int]
-    ):
-        self.frames = frames
-        self.durations = durations
-        self.idx = 0
+        self.interval = max(1, 1000 // max(1, ANIM_FPS))
+        self.expected = 0.0
 
-    def start(self):
-        if not self.frames:
-            return
-        self.active = True
-        self._tick()
+    def add(self, player):
+        player.due = time.monotonic()
+        self.players.add(player)
+        if self.job is None:
+            self.expected = time.monotonic()
+            self.job = self.widget.after(0, self._tick)
 
-    def stop(self):
-        self.active = False
-        if self.job is not None:
+    def remove(self, player):
+        self.players.discard(player)
+        if not self.players and self.job is not None:
             try:
-                self.label.after_cancel(self.job)
+                self.widget.after_cancel(self.job)
             except Exception:
                 pass
             self.job = None
 
     def _tick(self):
-        if not self.active or not self.frames:
-            return
-        self.label.configure(image=self.frames[self.idx])
-        delay = self.durations[self.idx] if self.durations else 100
-        self.idx = (self.idx + 1) % len(self.frames)
-        self.job = self.label.after(delay, self._tick)
+        self.job = None
+        now = time.monotonic()
+        hold = self.quality.tile_interval if self.quality is not None else 0.0
+        due = [p for p in self.players
+               if p.due <= now and self.visible(p)
+               and (p.tile is None or now - p.shown_at >= hold)]
+        due.sort(key=lambda p: p.due)
+        for p in due[:ANIM_MAX_UPDATES]:
+            p.advance(now)
+        if self.quality is not None:
+            self.quality.sample(time.monotonic() - now, now - self.expected, now)
+        if self.players:
+            self.expected = time.monotonic() + self.interval / 1000
+            self.job = self.widget.after(self.interval, self._tick)
 
 
-class PreviewAnim:
-    def __init__(self, label: tk.Label):
+class AnimPlayer:
+    # Plays a FrameStore or an AnimStream on a label. Each frame is pasted
+    # into one PhotoImage owned by the player, so only the frame on screen
+    # exists in Tk; for stores only the region that changed since the
+    # previous frame is pasted. Frame deadlines
+    # are absolute (monotonic clock): when the Tk thread falls behind, late
+    # frames are skipped so playback keeps wall-clock speed instead of
+    # slowing down. Dropped frames and lateness are tallied for stats().
+    def __init__(self, label: tk.Label, scheduler: AnimScheduler):
         self.label = label
-        self.frames: list[ImageTk.PhotoImage] = []
+        self.scheduler = scheduler
+        self.tile: Optional["Tile"] = None
+        self.frames: Optional[FrameStore] = None
+        self.photo: Optional[ImageTk.PhotoImage] = None
+        self.photo_mode = ""
+        # Index of the store frame currently held by self.photo
+        self.shown_idx: Optional[int] = None
         self.durations: list[int] = []
+        self.loop_s = 0.0
+        self.stream: Optional[AnimStream] = None
         self.idx = 0
-        self.job: Optional[str] = None
+        self.due = 0.0
+        self.shown_at = 0.0
         self.active = False
+        self.shown = 0
+        self.dropped = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
 
-    def set_frames(
-        self, frames: list[ImageTk.PhotoImage], durations: list[int]
-    ):
+    def set_frames(self, frames: Optional[FrameStore]):
         self.frames = frames
-        self.durations = durations
+        self.durations = frames.durations if frames is not None else []
+        self.loop_s = sum(self.durations) / 1000 if self.durations else 0.1
+        self.stream = None
         self.idx = 0
+        self.shown_idx = None
+
+    def set_stream(self, stream: AnimStream):
+        self.frames = None
+        self.durations = []
+        self.stream = stream
+        self.idx = 0
+        self.shown_idx = None
 
     def start(self):
-        if not self.frames:
+        if not self.frames and self.stream is None:
             return
         self.active = True
-        self._tick()
+        self.scheduler.add(self)
 
     def stop(self):
         self.active = False
-        if self.job is not None:
+        self.scheduler.remove(self)
+
+    def _duration(self, idx: int) -> float:
+        if not self.durations:
+            return 0.1
+        return self.durations[idx % len(self.durations)] / 1000
+
+    def advance(self, now: float):
+        if self.stream is not None:
+            self._advance_stream(now)
+            return
+        if not self.frames:
+            self.stop()
+            return
+        n = len(self.frames)
+        late = now - self.due
+        if late >= self.loop_s:
+            # Paused (off-screen, unfocused) rather than overloaded: resync
+            self.due = now
+            late = 0.0
+        # Skip the frames whose slot has already passed
+        skipped = 0
+        while late > self._duration(self.idx):
+            late -= self._duration(self.idx)
+            self.due += self._duration(self.idx)
+            self.idx = (self.idx + 1) % n
+            skipped += 1
+        self._record(late, skipped)
+        if self.shown_idx is None:
+            dirty = (0, 0) + self.frames.size
+        else:
+            dirty = self.frames.changed(self.shown_idx, self.idx)
+        self._show(self.frames.image(self.idx), dirty)
+        self.shown_idx = self.idx
+        self.due += self._duration(self.idx)
+        self.idx = (self.idx + 1) % n
+
+    def _advance_stream(self, now: float):
+        store = self.stream.packed()
+        if store is not None:
+            # Fully decoded: play the packed frames from the same position,
+            # with changed-region pastes
+            idx, due = self.idx % len(store), self.due
+            self.set_frames(store)
+            self.idx, self.due = idx, due
+            self.advance(now)
+            return
+        item = self.stream.frame(self.idx)
+        if item is None:
+            # Not decoded yet; keep showing the current image
+            if self.stream.failed:
+                self.stop()
+            else:
+                self.due = now + STREAM_POLL_MS / 1000
+            return
+        im, delay = item
+        late = now - self.due
+        if late >= 1.0:
+            # Paused rather than overloaded: resync
+            self.due = now
+            late = 0.0
+        # Skip frames whose slot has passed, as far as they are decoded
+        skipped = 0
+        while late > delay / 1000:
+            nxt = self.stream.frame(self.idx + 1)
+            if nxt is None:
+                break
+            late -= delay / 1000
+            self.due += delay / 1000
+            self.idx += 1
+            im, delay = nxt
+            skipped += 1
+        self._record(late, skipped)
+        self._show(im)
+        self.idx += 1
+        self.due += delay / 1000
+
+    def _show(self, im: Image.Image,
+              dirty: Optional[tuple[int, int, int, int]] = (0, 0, 1 << 30, 1 << 30)):
+        # dirty: the part of im that differs from what the photo holds
+        mode = "RGBA" if im.mode == "RGBA" else "RGB"
+        photo = self.photo
+        if (photo is None or mode != self.photo_mode
+                or (photo.width(), photo.height()) != im.size):
+            photo = self.photo = ImageTk.PhotoImage(mode, im.size)
+            self.photo_mode = mode
+            dirty = (0, 0) + im.size
+        self.shown_at = time.monotonic()
+        if dirty is not None:
+            w, h = im.size
+            x0, y0 = max(0, dirty[0]), max(0, dirty[1])
+            x1, y1 = min(w, dirty[2]), min(h, dirty[3])
+            with PROFILER.span("photo.paste", area=(x1 - x0) * (y1 - y0)):
+                if (x1 - x0) * (y1 - y0) * 2 > w * h:
+                    photo.paste(im if im.mode == mode else im.convert(mode))
+                else:
+                    region = im.crop((x0, y0, x1, y1)).convert(mode)
+                    scratch = ImageTk.PhotoImage(region)
+                    photo.tk.call(str(photo), "copy", str(scratch), "-to",
+                                  x0, y0, "-compositingrule", "set")
+        self.label.configure(image=photo)
+
+    def _record(self, late: float, skipped: int):
+        self.shown += 1
+        self.dropped += skipped
+        late = max(0.0, late)
+        self.jitter_total += late
+        self.jitter_max = max(self.jitter_max, late)
+
+    def stats(self) -> dict:
+        return {
+            "shown": self.shown,
+            "dropped": self.dropped,
+            "jitter_mean_ms": 1000 * self.jitter_total / max(1, self.shown),
+            "jitter_max_ms": 1000 * self.jitter_max,
+        }
+
+
+class Tile:
+    # Pooled grid cell, rebound to a different file as the view scrolls
+    def __init__(self, app: "PickerApp"):
+        self.app = app
+        self.path: Optional[Path] = None
+        self.index = -1
+        self.future: Optional[Job] = None
+
+        # Each card is its own canvas item at canvas coordinates: X11 window
+        # geometry is 16-bit, so a single rows*row_h frame breaks past ~32k px
+        self.card = tk.Frame(app.canvas, bg=COL_FRAME,
+                             bd=0, highlightthickness=0)
+        self.item = app.canvas.create_window(
+            (0, 0), window=self.card, anchor="nw", state="hidden")
+        inner = tk.Frame(self.card, bg=COL_BG, bd=0, highlightthickness=0)
+        inner.pack(padx=1, pady=1)
+        self.label = tk.Label(inner, bg=COL_BG, bd=0, cursor="hand2")
+        self.label.pack()
+        self.anim = AnimPlayer(self.label, app.anim_scheduler)
+        self.anim.tile = self
+
+        # Bindings are created once and read the current path at event time
+        self.label.bind("<Button-1>", self._on_click)
+        self.label.bind("<Button-3>", self._on_preview)
+        self.label.bind("<Enter>", self._on_enter)
+        self.label.bind("<Leave>", self._on_leave)
+        self.label.bind("<Destroy>", lambda _e: self.anim.stop())
+
+    def _on_enter(self, _e=None):
+        self.card.configure(bg=COL_HOVER)
+        self.app.hover_tile = self
+        self.app.on_tile_hover(self)
+
+    def _on_leave(self, _e=None):
+        self.card.configure(bg=COL_FRAME)
+        if self.app.hover_tile is self:
+            self.app.hover_tile = None
+
+    def _on_click(self, _e=None):
+        if self.path is not None:
+            self.app.apply_wallpaper(self.path)
+
+    def _on_preview(self, _e=None):
+        if self.path is not None:
+            self.app.show_preview(self.path)
+
+    def bind(self, index: int, path: Path):
+        self.index = index
+        self.path = path
+        app = self.app
+        photo = app.cached_thumb(path)
+        if photo is None:
+            # Placeholder now, real thumbnail once the worker pool delivers
+            photo = app.placeholder
+            app.request_thumb(path)
+        self.label.configure(image=photo)
+
+        if path.suffix.lower() not in (".gif", ".webp"):
+            return
+        key = (path, THUMB_SIZE)
+        cached = app.anim_cache.get(key)
+        if cached is not None:
+            self.anim.set_frames(cached)
+            self.anim.start()
+            return
+
+        def done_cb(fut: Future, expected=path, k=key):
+            if fut.cancelled():
+                return
             try:
-                self.label.after_cancel(self.job)
+                store = fut.result()
             except Exception:
-                pass
-            self.job = None
+                return
 
-    def _tick(self):
-        if not self.active or not self.frames:
-            return
-        self.label.configure(image=self.frames[self.idx])
-        delay = self.durations[self.idx] if self.durations else 100
-        self.idx = (self.idx + 1) % len(self.frames)
-        self.job = self.label.after(delay, self._tick)
+            def apply_frames():
+                with PROFILER.span("apply_frames"):
+                    app.anim_cache.put(k, store)
+                    if self.path != expected or not self.label.winfo_exists():
+                        return
+                    self.anim.set_frames(store)
+                    self.anim.start()
+
+            self.label.after(0, apply_frames)
+
+        self.future = app.jobs.submit(
+            "job.anim_thumb", load_animation_store, path, THUMB_SIZE, COL_BG,
+            priority=PRIO_NEAR)
+        self.future.add_done_callback(done_cb)
+
+    def unbind(self):
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+        self.anim.stop()
+        self.anim.set_frames(None)
+        self.card.configure(bg=COL_FRAME)
+        self.path = None
+        self.index = -1
 
 
 class PickerApp:
-    def __init__(self, root: tk.Tk, files: List[Path]):
+    def __init__(self, root: tk.Tk, files: List[Path],
+                 index: Optional[LibraryIndex] = None):
         self.root = root
+        self.index = index
+        self.watcher: Optional[DirWatcher] = None
+        self.pending_files: Optional[List[Path]] = None
+        self.pending_index: Optional[LibraryIndex] = None
+        self._polling = False
         self.root.title("Wallpaper Picker")
         self.root.geometry("1680x1050")
         self.root.configure(bg=COL_BG)
 
-        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
-        self.prefetch_executor = ThreadPoolExecutor(
-            max_workers=PREFETCH_WORKERS)
+        # With the process backend these threads only wait on the decode
+        # pool, so size them to keep every decode process busy
+        workers = MAX_WORKERS
+        if DECODE_BACKEND == "process":
+            workers = max(MAX_WORKERS, DECODE_PROCS)
+        self.speculative = max(1, min(PREFETCH_WORKERS, workers - 1))
+        self.jobs = WorkScheduler(workers, self.speculative)
+
+        # One timer drives every animation; tiles off-screen or under the
+        # preview overlay are skipped
+        self.visible_range = range(0)
+        self.preview_open = False
+        self.hover_tile: Optional[Tile] = None
+        self.quality = (QualityController(self._on_quality_change)
+                        if ADAPTIVE else None)
+        self.anim_scheduler = AnimScheduler(
+            root, self._anim_visible, self.quality)
+
+        # Search box; filters the grid on every keystroke
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(
+            root, textvariable=self.search_var, bg=COL_HOVER, fg="#e0e0e0",
+            insertbackground="#e0e0e0", relief="flat", bd=6,
+            highlightthickness=0, font=("TkDefaultFont", 12))
+        self.search_entry.pack(side=tk.TOP, fill=tk.X, padx=TILE_PAD,
+                               pady=(TILE_PAD, 0))
+        self.search_entry.bind("<Return>", self._apply_first_match)
+        self.search_var.trace_add("write", self._on_search_changed)
+        self.search: Optional[SearchIndex] = None
+        self._search_gen = 0
+        self._search_job: Optional[str] = None
+        root.bind("<Control-f>", lambda _e: self.search_entry.focus_set())
 
         # Canvas (no visible scrollbar)
         self.canvas = tk.Canvas(
@@ -247,14 +3239,9 @@ class PickerApp:
         )
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.canvas.bind("<Configure>", self.on_canvas_configure)
+        self.canvas.configure(yscrollcommand=self._on_yview)
         self._bind_scrolling()
 
-        # Grid frame
-        self.grid_frame = tk.Frame(
-            self.canvas, bg=COL_BG, bd=0, highlightthickness=0)
-        self.frame_id = self.canvas.create_window(
-            (0, 0), window=self.grid_frame, anchor="nw")
-
         # Overlay preview container (initially hidden)
         self.overlay = tk.Frame(
             self.canvas, bg=COL_OVERLAY_BG, bd=0, highlightthickness=0)
@@ -268,12 +3255,23 @@ class PickerApp:
         self.preview_label = tk.Label(
             self.preview_wrap, bg=COL_PREVIEW_BG, bd=0)
         self.preview_label.pack()
-        self.preview_anim = PreviewAnim(self.preview_label)
-        self.preview_loading_future: Optional[Future] = None
+        self.preview_anim = AnimPlayer(
+            self.preview_label, self.anim_scheduler)
+        self.preview_stream: Optional[AnimStream] = None
 
         # Track current preview state to avoid race conditions
         self.current_preview_path: Optional[Path] = None
+        self.current_preview_key: Optional[AnimKey] = None
         self.current_preview_token: int = 0  # increment each preview open
+        # Preview decodes started on a guess (hover, scroll), oldest first;
+        # preview_wait is one the open preview is waiting for
+        self.preview_jobs: OrderedDict[AnimKey, Job] = OrderedDict()
+        self.preview_wait: Optional[Job] = None
+        self._hover_job: Optional[str] = None
+        self._predict_job: Optional[str] = None
+        self._scroll_t = 0.0
+        self._scroll_y = 0.0
+        self._scroll_v = 0.0  # px/s, smoothed
 
         # Close overlay on Esc or click/right-click anywhere on overlay/preview
         root.bind("<Escape>", self._esc_handler)
@@ -287,18 +3285,41 @@ class PickerApp:
             w.bind("<Button-4>", lambda e: "break")
             w.bind("<Button-5>", lambda e: "break")
 
+        # library: every wallpaper; entries: the library with near-duplicates
+        # collapsed (when DEDUP); files: the entries shown (search results)
+        self.library = files
+        self.entries = files
         self.files = files
+        self.features: Optional[FeatureIndex] = None
+        self.dup_rep: dict[Path, Path] = {}
+        self._feature_job: Optional[Job] = None
+        # Insertion-ordered, oldest first; trimmed to roughly the tile pool
         self.thumb_cache: dict[Path, ImageTk.PhotoImage] = {}
-        self.anim_labels: list[tk.Label] = []
+        self.tiles: dict[int, Tile] = {}
+        self.tile_pool: list[Tile] = []
+        self._refresh_pending = False
+        self.placeholder = ImageTk.PhotoImage(
+            Image.new("RGB", THUMB_SIZE, (43, 43, 43)))
+        self.thumb_jobs: dict[Path, Job] = {}
+        self.thumb_ready: deque[tuple[Path, Job]] = deque()
+        self._drain_job: Optional[str] = None
 
         # Cache for animated frames: key = (path, size_tuple)
-        self.anim_cache: dict[
-            tuple[Path, tuple[int, int]],
-            tuple[list[ImageTk.PhotoImage], list[int]],
-        ] = {}
+        self.anim_cache = AnimCache(
+            ANIM_CACHE_MB * 1024 * 1024, self._pinned_anim_keys)
 
-        self.populate()
+        with PROFILER.span("populate"):
+            self.populate()
         self._start_background_prefetch()
+        if PRERENDER:
+            self.jobs.submit(
+                "job.prerender", prerender_variants, prerender_wanted(),
+                priority=PRIO_PREFETCH)
+        PROFILER.watch_mainloop(root)
+
+        self._build_search_index()
+        self._start_features()
+        self.search_entry.focus_set()
 
         # Pause/resume animations with focus
         root.bind("<FocusOut>", self.pause_all)
@@ -307,23 +3328,191 @@ class PickerApp:
         # Shutdown threads on close
         root.protocol("WM_DELETE_WINDOW", self._on_close)
 
+        if WATCH and index is not None:
+            self._start_watch(index)
+
+    def scan_after_paint(self, wall_dir: Path):
+        # Built from a grid snapshot: scan the library once the first frame
+        # is on screen, off the Tk thread, and apply any difference
+        def run():
+            with PROFILER.span("find_images", deferred=True):
+                files = SERVICE.files(wall_dir)
+                index = LibraryIndex(wall_dir)
+                if files is None:
+                    files = index.refresh() if wall_dir.exists() else []
+                    index.save()
+            if files != self.library:
+                save_grid_snapshot(wall_dir, files)
+            self.pending_index = index
+            self.pending_files = files
+
+        def start():
+            threading.Thread(target=run, daemon=True).start()
+            self._ensure_polling()
+
+        self.root.after_idle(self.root.after, 0, start)
+
     def _esc_handler(self, _e):
         if self.is_preview_visible():
             self.hide_preview()
+        elif self.search_var.get():
+            self.search_var.set("")
         else:
             self._on_close()
 
+    # Search
+    def _build_search_index(self):
+        # Built on a worker; the query typed meanwhile is applied once ready.
+        # Covers the whole library so collapsed duplicates can be found
+        self._search_gen += 1
+        gen = self._search_gen
+        library = self.library
+        wall_dir = Path(WALL_DIR).expanduser()
+        index = self.index
+        features = self.features
+        meta = [index.info(p) if index is not None else None for p in library]
+
+        def build() -> SearchIndex:
+            colours = None
+            if features is not None:
+                colours = [(f or (None, None))[1] for f in
+                           (features.get(p, m) for p, m in zip(library, meta))]
+            search = SearchIndex(library, wall_dir, meta, colours)
+            # Usable (by scanning) straight away; trigrams follow
+            self.root.after(0, self._search_ready, search, gen)
+            search.build_grams()
+            return search
+
+        self.jobs.submit("job.search_index", build, priority=PRIO_NEAR)
+
+    def _search_ready(self, search: SearchIndex, gen: int):
+        if gen != self._search_gen:
+            return  # superseded by a newer build
+        self.search = search
+        if self.search_var.get():
+            self._run_search()
+
+    def _on_search_changed(self, *_args):
+        if self._search_job is None:
+            self._search_job = self.root.after_idle(self._run_search)
+
+    def _run_search(self):
+        self._search_job = None
+        query = self.search_var.get()
+        if self.search is None:
+            return
+        with PROFILER.span("search", query=query) as info:
+            ids = self.search.search(query)
+            info["results"] = len(ids)
+        if not query.strip():
+            files = self.entries
+        else:
+            # Ids index the search's own file list, which can lag behind
+            # the library until a rebuild lands
+            files = [self.search.files[i] for i in ids]
+            if self.search.files is not self.library:
+                present = set(self.library)
+                files = [p for p in files if p in present]
+            if DEDUP and self.dup_rep:
+                # A duplicate only shows when its representative does not
+                hits = set(files)
+                files = [p for p in files
+                         if self.dup_rep.get(p, p) == p
+                         or self.dup_rep[p] not in hits]
+        if files != self.files:
+            self.files = files
+            self.canvas.yview_moveto(0)
+            self._layout()
+        title = "Wallpaper Picker"
+        if query.strip():
+            title += f" - {len(files)} of {len(self.entries)}"
+        self.root.title(title)
+
+    # Duplicates
+    def _start_features(self):
+        # Hashes and colours for files not yet in the FeatureIndex, computed
+        # in batches at prefetch priority (so grid work always comes first)
+        # and saved after each; duplicates are grouped on the worker too and
+        # collapse once the pass is done
+        if self.index is None:
+            return
+        if self._feature_job is not None:
+            self._feature_job.cancel()
+        index, library = self.index, self.library
+        features = self.features
+        wall_dir = Path(WALL_DIR).expanduser()
+
+        def group(features: FeatureIndex):
+            with PROFILER.span("dedup", files=len(library)) as info:
+                dup_rep = duplicate_groups(
+                    library, features, index, DUP_DISTANCE)
+                info["duplicates"] = len(dup_rep)
+            self.root.after(0, self._features_ready, features, library,
+                            dup_rep)
+
+        def batch(features: FeatureIndex, todo: List[Path]):
+            features.compute(todo[:FEATURE_BATCH], index)
+            features.save()
+            todo = todo[FEATURE_BATCH:]
+            if todo:
+                self._feature_job = self.jobs.submit(
+                    "job.features", batch, features, todo,
+                    priority=PRIO_PREFETCH)
+            else:
+                group(features)
+
+        def start():
+            nonlocal features
+            if features is None:
+                features = FeatureIndex(wall_dir)
+            features.prune(library)
+            # Group what is already known straight away
+            group(features)
+            todo = features.missing(library, index)
+            if todo:
+                batch(features, todo)
+            else:
+                features.save()
+
+        self._feature_job = self.jobs.submit(
+            "job.features", start, priority=PRIO_PREFETCH)
+
+    def _features_ready(self, features: FeatureIndex, library: List[Path],
+                        dup_rep: dict[Path, Path]):
+        if library is not self.library:
+            return  # the library changed meanwhile; a new pass is running
+        self.features = features
+        self.dup_rep = dup_rep
+        self._update_entries()
+
+    def _update_entries(self):
+        entries = self.library
+        if DEDUP and self.dup_rep:
+            rep = self.dup_rep
+            entries = [p for p in entries if rep.get(p, p) == p]
+        self.entries = entries
+        if not self.search_var.get().strip() and self.files != entries:
+            self.files = entries
+            self._layout()
+        self._build_search_index()
+
+    def _apply_first_match(self, _e=None):
+        if self.files:
+            self.apply_wallpaper(self.files[0])
+
     def _on_close(self):
-        try:
-            if self.preview_loading_future:
-                self.preview_loading_future.cancel()
-        except Exception:
-            pass
-        for ex in (self.executor, self.prefetch_executor):
-            try:
-                ex.shutdown(wait=False, cancel_futures=True)
-            except Exception:
-                pass
+        PROFILER.counters["anim_cache"] = self.anim_cache.stats()
+        PROFILER.counters["preview_player"] = self.preview_anim.stats()
+        if self.quality is not None:
+            PROFILER.counters["quality"] = self.quality.stats()
+        PROFILER.dump()
+        if self.preview_stream is not None:
+            self.preview_stream.close()
+        if self.watcher is not None:
+            self.watcher.close()
+        # Queued jobs are dropped, running decodes stop at their next
+        # checkpoint
+        self.jobs.shutdown()
         self.root.destroy()
 
     def _bind_scrolling(self):
@@ -347,20 +3536,24 @@ class PickerApp:
         y1 = int(self.canvas.canvasy(self.canvas.winfo_height()))
         return x0, y0, x1, y1
 
+    def _preview_box(self) -> tuple[int, int]:
+        # Overlay (the viewport) minus margins
+        x0, y0, x1, y1 = self._visible_region()
+        margin = 40
+        return (max(100, x1 - x0 - 2 * margin),
+                max(100, y1 - y0 - 2 * margin))
+
     def _position_overlay_to_view(self):
         x0, y0, x1, y1 = self._visible_region()
         w = max(1, x1 - x0)
         h = max(1, y1 - y0)
         self.canvas.itemconfig(self.overlay_id, width=w, height=h)
         self.canvas.coords(self.overlay_id, x0, y0)
-        margin = 40
-        max_w = max(100, w - 2 * margin)
-        max_h = max(100, h - 2 * margin)
+        max_w, max_h = self._preview_box()
         self.preview_wrap.configure(width=max_w, height=max_h)
 
     def on_canvas_configure(self, _event):
-        self.canvas.itemconfig(self.frame_id, width=self.canvas.winfo_width())
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        self._layout()
         if self.is_preview_visible():
             self._position_overlay_to_view()
 
@@ -371,99 +3564,276 @@ class PickerApp:
         self.canvas.yview_scroll(-int(delta), "units")
 
     def pause_all(self, _e=None):
-        for lbl in self.anim_labels:
-            anim: TileAnim = getattr(lbl, "_anim", None)
-            if anim:
-                anim.stop()
+        for tile in self.tiles.values():
+            tile.anim.stop()
 
     def resume_all(self, _e=None):
-        for lbl in self.anim_labels:
-            anim: TileAnim = getattr(lbl, "_anim", None)
-            if anim:
-                anim.start()
+        for tile in self.tiles.values():
+            tile.anim.start()
 
+    # Virtualized grid: only rows inside the viewport (plus OVERSCAN_ROWS)
+    # have widgets; tiles are recycled from a pool as the view scrolls.
     def populate(self):
-        for w in self.grid_frame.winfo_children():
-            w.destroy()
-        self.anim_labels.clear()
-
-        for idx, p in enumerate(self.files):
-            r = idx // COLUMNS
-            c = idx % COLUMNS
-
-            card = tk.Frame(self.grid_frame, bg=COL_FRAME,
-                            bd=0, highlightthickness=0)
-            card.grid(row=r, column=c, padx=10, pady=10, sticky="nsew")
-
-            inner = tk.Frame(card, bg=COL_BG, bd=0, highlightthickness=0)
-            inner.pack(padx=1, pady=1)
-
-            img_lbl = tk.Label(inner, bg=COL_BG, bd=0, cursor="hand2")
-            img_lbl.pack()
-
-            if p not in self.thumb_cache:
-                self.thumb_cache[p] = build_static_thumb(p, THUMB_SIZE)
-            img_lbl.configure(image=self.thumb_cache[p])
-
-            # Right-click: preview overlay
-            img_lbl.bind("<Button-3>", lambda _e, fp=p: self.show_preview(fp))
-
-            # Animated load in background
-            if p.suffix.lower() in (".gif", ".webp"):
-                anim = TileAnim(img_lbl)
-                img_lbl._anim = anim
-                self.anim_labels.append(img_lbl)
-
-                key = (p, THUMB_SIZE)
-                if key in self.anim_cache:
-                    frames, durs = self.anim_cache[key]
-                    anim.set_frames(frames, durs)
-                    anim.start()
+        for idx in list(self.tiles):
+            self._release_tile(idx)
+        self._layout()
+
+    def _row_height(self) -> int:
+        return THUMB_SIZE[1] + 2 + 2 * TILE_PAD
+
+    def _col_width(self) -> int:
+        return max(THUMB_SIZE[0] + 2 + 2 * TILE_PAD,
+                   self.canvas.winfo_width() // COLUMNS)
+
+    def _layout(self):
+        rows = (len(self.files) + COLUMNS - 1) // COLUMNS
+        width = self._col_width() * COLUMNS
+        height = rows * self._row_height()
+        self.canvas.configure(scrollregion=(0, 0, width, height))
+        self._refresh_pending = False
+        self._refresh_visible()
+
+    def _on_yview(self, first, _last):
+        # Called by the canvas whenever the view moves; coalesce to one
+        # refresh per idle cycle
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            self.root.after_idle(self._refresh_visible)
+        self._track_scroll(float(first))
+
+    def _row_range(self, overscan: int) -> range:
+        _, y0, _, y1 = self._visible_region()
+        row_h = self._row_height()
+        rows = (len(self.files) + COLUMNS - 1) // COLUMNS
+        first = max(0, y0 // row_h - overscan)
+        last = min(rows, y1 // row_h + 1 + overscan)
+        return range(first * COLUMNS, min(len(self.files), last * COLUMNS))
+
+    def _refresh_visible(self):
+        with PROFILER.span("grid.refresh"):
+            self._refresh_pending = False
+            visible = self._row_range(0)
+            wanted = self._row_range(OVERSCAN_ROWS)
+            self.visible_range = visible
+            # Tiles whose file moved (search, library changes) follow it to
+            # its new cell instead of being unbound and rebound
+            keep: dict[int, Tile] = {}
+            loose: list[Tile] = []
+            for idx, tile in self.tiles.items():
+                if idx in wanted and tile.path == self.files[idx]:
+                    keep[idx] = tile
                 else:
-                    def done_cb(fut: Future, lbl=img_lbl, a=anim, path=p, k=key):
-                        try:
-                            frames, durs = fut.result()
-                        except Exception:
-                            frames, durs = [self.thumb_cache[path]], [1000]
-
-                        def apply_frames():
-                            if not lbl.winfo_exists():
-                                return
-                            a.set_frames(frames, durs)
-                            a.start()
-                            self.anim_cache[k] = (frames, durs)
-
-                        lbl.after(0, apply_frames)
-
-                    fut = self.executor.submit(
-                        load_animation_frames, p, THUMB_SIZE)
-                    fut.add_done_callback(done_cb)
-            else:
-                img_lbl._anim = None
+                    loose.append(tile)
+            if loose:
+                where = {self.files[i]: i for i in wanted if i not in keep}
+                for tile in loose:
+                    new = where.pop(tile.path, None)
+                    if new is None:
+                        self._release(tile)
+                    else:
+                        tile.index = new
+                        keep[new] = tile
+                self.tiles = keep
+            col_w = self._col_width()
+            row_h = self._row_height()
+            # Bind on-screen rows first so their thumbnails are queued first
+            order = [*visible, *(i for i in wanted if i not in visible)]
+            for idx in order:
+                tile = self.tiles.get(idx)
+                if tile is None:
+                    tile = self.tile_pool.pop() if self.tile_pool else Tile(self)
+                    self.tiles[idx] = tile
+                    tile.bind(idx, self.files[idx])
+                r, c = divmod(idx, COLUMNS)
+                self.canvas.coords(
+                    tile.item, c * col_w + TILE_PAD, r * row_h + TILE_PAD)
+                self.canvas.itemconfigure(
+                    tile.item, state="normal",
+                    width=col_w - 2 * TILE_PAD,
+                    height=row_h - 2 * TILE_PAD)
+            self._reprioritize(visible)
+            self._trim_thumb_cache()
+
+    def _release_tile(self, idx: int):
+        self._release(self.tiles.pop(idx))
 
-            def on_destroy(_e, lbl=img_lbl):
-                a: TileAnim = getattr(lbl, "_anim", None)
-                if a:
-                    a.stop()
+    def _release(self, tile: Tile):
+        if tile.path is not None:
+            self._cancel_thumb(tile.path)
+        tile.unbind()
+        self.canvas.itemconfigure(tile.item, state="hidden")
+        self.tile_pool.append(tile)
 
-            img_lbl.bind("<Destroy>", on_destroy)
+    def _anim_visible(self, player) -> bool:
+        tile = getattr(player, "tile", None)
+        if tile is None:
+            return True
+        if self.quality is not None and self.quality.focus_only:
+            return not self.preview_open and tile is self.hover_tile
+        return not self.preview_open and tile.index in self.visible_range
+
+    def _on_quality_change(self, level: int):
+        self.jobs.set_speculative(1 if level else self.speculative)
+
+    def _pinned_anim_keys(self) -> set[AnimKey]:
+        keys = {(t.path, THUMB_SIZE) for t in self.tiles.values() if t.path}
+        if self.current_preview_key is not None:
+            keys.add(self.current_preview_key)
+        return keys
+
+    def _trim_thumb_cache(self):
+        # Keep bound thumbnails plus a small LRU tail for quick scroll-back
+        limit = 2 * max(1, len(self.tiles))
+        bound = {t.path for t in self.tiles.values()}
+        for p in list(self.thumb_cache):
+            if len(self.thumb_cache) <= limit:
+                break
+            if p not in bound:
+                del self.thumb_cache[p]
+
+    def cached_thumb(self, path: Path) -> Optional[ImageTk.PhotoImage]:
+        # PhotoImages only: atlas hits (a stat, the atlas lock and an mmap
+        # copy) are resolved by the thumb job, off the Tk thread
+        photo = self.thumb_cache.pop(path, None)
+        if photo is not None:
+            self.thumb_cache[path] = photo
+        return photo
+
+    # Static thumbnails are decoded on the worker pool as PIL images and
+    # converted to PhotoImages on the Tk thread by _drain_thumbs
+    def request_thumb(self, path: Path, priority: int = PRIO_VISIBLE):
+        old = self.thumb_jobs.get(path)
+        if old is not None and not old.stop_requested:
+            self.jobs.reprioritize(old, priority)
+            return
+        fut = self.jobs.submit("job.thumb", decode_static_thumb, path,
+                               THUMB_SIZE, priority=priority)
+        self.thumb_jobs[path] = fut
+        fut.add_done_callback(
+            lambda f, p=path: self.thumb_ready.append((p, f)))
+        if self._drain_job is None:
+            self._drain_job = self.root.after(
+                THUMB_APPLY_MS, self._drain_thumbs)
+
+    def _cancel_thumb(self, path: Path):
+        fut = self.thumb_jobs.get(path)
+        if fut is not None and fut.cancel():
+            del self.thumb_jobs[path]
 
-            img_lbl.bind("<Enter>", lambda _e,
-                         w=card: w.configure(bg=COL_HOVER))
-            img_lbl.bind("<Leave>", lambda _e,
-                         w=card: w.configure(bg=COL_FRAME))
+    def _reprioritize(self, visible: range):
+        # Scrolling changes what is urgent: on-screen tiles jump ahead of
+        # overscan ones, which stay ahead of speculative prefetch
+        for idx, tile in self.tiles.items():
+            prio = PRIO_VISIBLE if idx in visible else PRIO_NEAR
+            self.jobs.reprioritize(self.thumb_jobs.get(tile.path), prio)
+            self.jobs.reprioritize(tile.future, prio)
 
-            def on_click(_e=None, fp=p):
-                set_wallpaper(fp)
-                self._on_close()
+    def _drain_thumbs(self):
+        self._drain_job = None
+        deadline = time.monotonic() + THUMB_APPLY_BUDGET_MS / 1000
+        by_path = {t.path: t for t in self.tiles.values()}
+        with PROFILER.span("apply.thumbs") as info:
+            applied = 0
+            while self.thumb_ready and time.monotonic() < deadline:
+                path, fut = self.thumb_ready.popleft()
+                if self.thumb_jobs.get(path) is fut:
+                    del self.thumb_jobs[path]
+                if fut.cancelled():
+                    continue
+                try:
+                    im = fut.result()
+                except Exception:
+                    continue
+                photo = ImageTk.PhotoImage(im)
+                self.thumb_cache[path] = photo
+                applied += 1
+                tile = by_path.get(path)
+                if tile is not None and not tile.anim.active:
+                    tile.label.configure(image=photo)
+            info["count"] = applied
+        self._trim_thumb_cache()
+        if self.thumb_jobs or self.thumb_ready:
+            self._drain_job = self.root.after(
+                THUMB_APPLY_MS, self._drain_thumbs)
+
+    # Watch mode: the watcher thread publishes new file lists, the Tk thread
+    # picks them up and re-lays out the virtual grid in place
+    def _start_watch(self, index: LibraryIndex):
+        try:
+            self.watcher = DirWatcher(index, self._on_library_changed)
+        except OSError as exc:
+            print(f"Watch mode unavailable: {exc}", file=sys.stderr)
+            return
+        self._ensure_polling()
+
+    def _ensure_polling(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(250, self._poll_library)
+
+    def _on_library_changed(self, files: List[Path]):
+        self.pending_files = files
+
+    def _poll_library(self):
+        index, self.pending_index = self.pending_index, None
+        files, self.pending_files = self.pending_files, None
+        if files is not None and files != self.library:
+            if index is not None:
+                self.index = index
+            self.set_files(files)
+        elif index is not None:
+            # Same files, but now with metadata for the search filters
+            self.index = index
+            self._build_search_index()
+            self._start_features()
+        if index is not None and WATCH and self.watcher is None:
+            self._start_watch(index)
+        self.root.after(250, self._poll_library)
+
+    def set_files(self, files: List[Path]):
+        self.library = files
+        self.search = None
+        # Groups of the files still present stay collapsed until the
+        # feature pass over the new library regroups them
+        present = set(files)
+        self.dup_rep = {p: r for p, r in self.dup_rep.items()
+                        if p in present and r in present}
+        entries = files
+        if DEDUP and self.dup_rep:
+            entries = [p for p in files if self.dup_rep.get(p, p) == p]
+        self.entries = entries
+        if self.search_var.get().strip():
+            # Keep showing the current results until the new index is ready
+            self.files = [p for p in self.files if p in present]
+        else:
+            self.files = entries
+        self._layout()
+        self._build_search_index()
+        self._start_features()
+        self.jobs.submit("job.atlas_prune", THUMB_ATLAS.prune, files,
+                         priority=PRIO_PREFETCH)
 
-            img_lbl.bind("<Button-1>", on_click)
+    def apply_wallpaper(self, path: Path):
+        # Hide straight away and let the transition run off the Tk thread;
+        # the window comes back with the error if swww fails
+        self.apply_result = None
+        self.root.withdraw()
+        WALLPAPER_SETTER.apply(path, self._on_applied)
+        self.root.after(50, self._poll_apply)
 
-        for cc in range(COLUMNS):
-            self.grid_frame.grid_columnconfigure(cc, weight=1)
+    def _on_applied(self, path: Path, ok: bool, err: str):
+        self.apply_result = (path, ok, err)
 
-        self.root.after(0, lambda: self.canvas.configure(
-            scrollregion=self.canvas.bbox("all")))
+    def _poll_apply(self):
+        if self.apply_result is None or not WALLPAPER_SETTER.idle():
+            self.root.after(50, self._poll_apply)
+            return
+        path, ok, err = self.apply_result
+        if ok:
+            self._on_close()
+            return
+        self.root.title(f"Wallpaper Picker - failed to set {path.name}: {err}")
+        self.root.deiconify()
 
     # Overlay preview
     def is_preview_visible(self) -> bool:
@@ -472,138 +3842,213 @@ class PickerApp:
     def show_preview(self, path: Path):
         # Show overlay at current viewport
         self.canvas.itemconfigure(self.overlay_id, state="normal")
+        # Tile windows are created later than the overlay, so raise it
+        self.overlay.lift()
+        self.preview_open = True
         # Disable global/canvas scrolling while preview is open
         self._unbind_scrolling()
         self._position_overlay_to_view()
 
         # Track current preview and token
         self.current_preview_path = path
+        self.current_preview_key = None
         self.current_preview_token += 1
         token = self.current_preview_token
 
-        # Determine target preview size (within margins)
-        w = int(self.canvas.itemcget(self.overlay_id, "width"))
-        h = int(self.canvas.itemcget(self.overlay_id, "height"))
-        margin = 40
-        box_w = max(100, w - 2 * margin)
-        box_h = max(100, h - 2 * margin)
+        # Target preview size (within margins); images are rendered at its
+        # bucket and the label crops them to the box
+        box_w, box_h = self._preview_box()
+        size = preview_bucket((box_w, box_h))
+        self.preview_label.configure(width=box_w, height=box_h)
 
         # Stop any prior preview animation and pending jobs
         self.preview_anim.stop()
-        if self.preview_loading_future:
-            try:
-                self.preview_loading_future.cancel()
-            except Exception:
-                pass
-            self.preview_loading_future = None
+        self._close_preview_stream()
+        self.preview_wait = None
 
         # 1) Show static preview immediately (cover + center-crop)
         try:
-            im = Image.open(path)
+            im = _open_reduced(path, size)
             if im.mode not in ("RGB", "RGBA"):
                 im = im.convert("RGB")
-            im = _resize_cover_16x9(im, (box_w, box_h))
+            im = _resize_cover_16x9(im, size)
         except Exception:
-            im = Image.new("RGB", (box_w, box_h), COL_PREVIEW_BG)
+            im = Image.new("RGB", size, COL_PREVIEW_BG)
         static_photo = ImageTk.PhotoImage(im)
         self.preview_label.configure(image=static_photo)
         self.preview_label.image = static_photo
 
         # 2) If animated, load frames in background and replace (cover) with cache
         if path.suffix.lower() in (".gif", ".webp"):
-            key = (path, (box_w, box_h))
-            if key in self.anim_cache:
+            key = (path, size)
+            self.current_preview_key = key
+            cached = self.anim_cache.get(key)
+            job = self.preview_jobs.pop(key, None)
+            if job is not None and not job.running():
+                job.cancel()  # not started: streaming is quicker to show
+                job = None
+            if cached is not None:
                 # Only apply if still the same preview request
                 if self.is_preview_visible() and token == self.current_preview_token:
-                    frames, durs = self.anim_cache[key]
-                    self.preview_anim.set_frames(frames, durs)
+                    self.preview_anim.set_frames(cached)
                     self.preview_anim.start()
+            elif job is not None:
+                # A prefetch is already decoding it; frames follow when done
+                self.preview_wait = job
             else:
-                fut = self.executor.submit(
-                    load_animation_frames, path, (box_w, box_h))
-                self.preview_loading_future = fut
+                # Stream frames so playback starts with the first decoded ones
+                def cache_full(store, k=key):
+                    self.anim_cache.put(k, store)
 
-                def done_cb(f: Future, k=key, expected_token=token, expected_path=path):
-                    try:
-                        frames, durs = f.result()
-                    except Exception:
-                        frames, durs = [], []
-
-                    def apply():
-                        # Abort if overlay not visible, or token/path mismatch (stale)
-                        if (
-                            not self.is_preview_visible()
-                            or expected_token != self.current_preview_token
-                            or self.current_preview_path != expected_path
-                            or not frames
-                        ):
-                            return
-                        self.preview_anim.set_frames(frames, durs)
-                        self.preview_anim.start()
-                        self.anim_cache[k] = (frames, durs)
-
-                    self.preview_label.after(0, apply)
-
-                fut.add_done_callback(done_cb)
+                self.preview_stream = AnimStream(
+                    path, size, COL_PREVIEW_BG, self.jobs, cache_full)
+                self.preview_anim.set_stream(self.preview_stream)
+                self.preview_anim.start()
+
+    def _close_preview_stream(self):
+        if self.preview_stream is not None:
+            self.preview_stream.close()
+            self.preview_stream = None
 
     def hide_preview(self):
         self.preview_anim.stop()
-        if self.preview_loading_future:
-            try:
-                self.preview_loading_future.cancel()
-            except Exception:
-                pass
-            self.preview_loading_future = None
+        self._close_preview_stream()
+        self.preview_wait = None
         # Clear current preview tracking
         self.current_preview_path = None
+        self.current_preview_key = None
         self.current_preview_token += 1  # invalidate any in-flight callbacks
         # Re-enable global/canvas scrolling
         self._bind_scrolling()
         self.canvas.itemconfigure(self.overlay_id, state="hidden")
-        self.preview_label.configure(image=None)
+        self.preview_open = False
+        self.preview_label.configure(image=None, width=0, height=0)
         self.preview_label.image = None
     # End overlay
 
-    # Background prefetch of animations for thumbnails and previews
+    # Predictive preview prefetch
+    def prefetch_preview(self, path: Path, priority: int):
+        if path.suffix.lower() not in (".gif", ".webp"):
+            return
+        key = (path, preview_bucket(self._preview_box()))
+        if key in self.anim_cache:
+            return
+        # Only what show_preview would keep whole: larger animations are
+        # streamed through a window, and decoding all of them is wasted
+        info = self.index.info(path) if self.index is not None else None
+        if info is None or not fits_whole(max(1, info[5]), key[1]):
+            return
+        job = self.preview_jobs.get(key)
+        if job is not None:
+            self.preview_jobs.move_to_end(key)
+            self.jobs.reprioritize(job, min(job.priority, priority))
+            return
+        while len(self.preview_jobs) >= PREVIEW_PREFETCH:
+            _, old = self.preview_jobs.popitem(last=False)
+            old.cancel()
+        job = self.jobs.submit(
+            "job.preview_prefetch", load_animation_store, path, key[1],
+            COL_PREVIEW_BG, priority=priority)
+        self.preview_jobs[key] = job
+        job.add_done_callback(
+            lambda fut, k=key: self.root.after(
+                0, self._preview_prefetched, k, fut))
+
+    def _preview_prefetched(self, key: AnimKey, fut: Job):
+        if self.preview_jobs.get(key) is fut:
+            del self.preview_jobs[key]
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        store = fut.result()
+        self.anim_cache.put(key, store)
+        if fut is self.preview_wait and key == self.current_preview_key:
+            self.preview_wait = None
+            self.preview_anim.set_frames(store)
+            self.preview_anim.start()
+
+    def on_tile_hover(self, tile: Tile):
+        # A short dwell filters out tiles the pointer only crosses
+        if self._hover_job is not None:
+            self.root.after_cancel(self._hover_job)
+        self._hover_job = self.root.after(
+            HOVER_PREFETCH_MS, self._hover_prefetch, tile, tile.path)
+
+    def _hover_prefetch(self, tile: Tile, path: Optional[Path]):
+        self._hover_job = None
+        if (tile is self.hover_tile and tile.path == path and path is not None
+                and not self.preview_open):
+            self.prefetch_preview(path, PRIO_VISIBLE)
+
+    def _track_scroll(self, first: float):
+        now = time.monotonic()
+        rows = (len(self.files) + COLUMNS - 1) // COLUMNS
+        y = first * rows * self._row_height()
+        dt = now - self._scroll_t
+        if 0 < dt < SCROLL_PREDICT_S:
+            self._scroll_v = 0.5 * self._scroll_v + 0.5 * (y - self._scroll_y) / dt
+        else:
+            self._scroll_v = 0.0
+        self._scroll_t, self._scroll_y = now, y
+        if self._predict_job is None:
+            self._predict_job = self.root.after(
+                SCROLL_PREDICT_MS, self._predict_previews)
+
+    def _predict_previews(self):
+        # Where the view will be SCROLL_PREDICT_S from now at the current
+        # velocity (or is, once scrolling stopped): its animated tiles,
+        # nearest the middle first. Not while flicking through the grid
+        self._predict_job = None
+        if self.preview_open:
+            return
+        view_h = max(1, self.canvas.winfo_height())
+        v = self._scroll_v
+        if time.monotonic() - self._scroll_t >= SCROLL_PREDICT_S:
+            v = 0.0
+        else:
+            # Check again once scrolling has stopped
+            self._predict_job = self.root.after(
+                int(SCROLL_PREDICT_S * 1000), self._predict_previews)
+        if abs(v) > 2 * view_h:
+            return
+        row_h = self._row_height()
+        rows = (len(self.files) + COLUMNS - 1) // COLUMNS
+        y = min(max(0.0, self._scroll_y + v * SCROLL_PREDICT_S),
+                max(0, rows * row_h - view_h))
+        first = int(y // row_h)
+        last = min(rows, int((y + view_h) // row_h) + 1)
+        middle = (y + view_h / 2) / row_h - 0.5
+        candidates = [i for i in range(first * COLUMNS,
+                                       min(len(self.files), last * COLUMNS))
+                      if self.files[i].suffix.lower() in (".gif", ".webp")]
+        candidates.sort(key=lambda i: abs(i // COLUMNS - middle))
+        # One slot is left for the hovered tile
+        for i in candidates[:max(1, PREVIEW_PREFETCH - 1)]:
+            self.prefetch_preview(self.files[i], PRIO_PREFETCH)
+
+    # Background prefetch of thumbnail animations
     def _start_background_prefetch(self):
         anim_paths = [p for p in self.files if p.suffix.lower()
                       in (".gif", ".webp")]
         if not anim_paths:
             return
 
-        # Estimate a preview target size based on initial window size (minus margins)
-        try:
-            self.root.update_idletasks()
-            canvas_w = self.canvas.winfo_width() or 1280
-            canvas_h = self.canvas.winfo_height() or 800
-        except Exception:
-            canvas_w, canvas_h = 1280, 800
-        margin = 40
-        preview_size = (max(100, canvas_w - 2 * margin),
-                        max(100, canvas_h - 2 * margin))
-
-        # Submit prefetch jobs to dedicated executor
+        # Queue speculative prefetch jobs behind everything on screen
         def prefetch_one(path: Path):
             results = {}
             try:
-                # Thumbnail cache
                 k_thumb = (path, THUMB_SIZE)
                 if k_thumb not in self.anim_cache:
-                    frames_t, durs_t = load_animation_frames(path, THUMB_SIZE)
-                    results[k_thumb] = (frames_t, durs_t)
-
-                # Preview cache
-                k_prev = (path, preview_size)
-                if k_prev not in self.anim_cache:
-                    frames_p, durs_p = load_animation_frames(
-                        path, preview_size)
-                    results[k_prev] = (frames_p, durs_p)
+                    results[k_thumb] = load_animation_store(
+                        path, THUMB_SIZE, COL_BG)
+            except JobCancelled:
+                raise
             except Exception:
                 pass
             return results
 
-        futures = [self.prefetch_executor.submit(
-            prefetch_one, p) for p in anim_paths]
+        futures = [self.jobs.submit("job.prefetch", prefetch_one, p,
+                                    priority=PRIO_PREFETCH)
+                   for p in anim_paths]
 
         # When each job completes, store into cache on the main thread to keep references safe
         def handle_done(fut: Future):
@@ -615,9 +4060,10 @@ class PickerApp:
                 return
 
             def apply():
-                for k, v in res.items():
-                    if k not in self.anim_cache:
-                        self.anim_cache[k] = v
+                with PROFILER.span("apply_frames", prefetch=True):
+                    for k, store in res.items():
+                        if k not in self.anim_cache:
+                            self.anim_cache.put(k, store)
 
             self.root.after(0, apply)
 
@@ -625,13 +4071,46 @@ class PickerApp:
             fut.add_done_callback(handle_done)
 
 
-def main():
+def _warm_one(path: Path, size: tuple[int, int], features: bool,
+              raw: bool) -> tuple[bool, Optional[list], Optional[bytes]]:
+    # Runs in a pool worker; a flag, the (small) features and, for the
+    # atlas, which only the parent writes, the raw thumbnail come back
+    try:
+        im = build_static_thumb_image(path, size)
+        feat = image_features(path, im) if features else None
+        data = None
+        if raw and not im.info.get("failed"):
+            data = im.convert("RGB").tobytes()
+        return True, feat, data
+    except Exception:
+        return False, None, None
+
+
+def _load_index() -> tuple[LibraryIndex, List[Path]]:
     wall_dir = Path(WALL_DIR).expanduser()
-    files = find_images(wall_dir)
+    with PROFILER.span("find_images") as info:
+        # With the cache service running its (saved) index is current
+        files = SERVICE.files(wall_dir)
+        info["service"] = files is not None
+        index = LibraryIndex(wall_dir)
+        if files is None:
+            files = index.refresh() if wall_dir.exists() else []
+            index.save()
+    return index, files
+
+
+def cmd_gui(args) -> int:
+    wall_dir = Path(WALL_DIR).expanduser()
+    index = None
+    files = load_grid_snapshot(wall_dir)
+    if files is None:
+        index, files = _load_index()
+        save_grid_snapshot(wall_dir, files)
     if not files:
         print(f"No images found in {wall_dir}", file=sys.stderr)
-        sys.exit(1)
+        return 1
 
+    load_gui()
     root = tk.Tk()
     try:
         root.wm_attributes("-type", "dialog")
@@ -639,8 +4118,246 @@ def main():
         pass
     root.bind("<Escape>", lambda e: root.destroy())
 
-    app = PickerApp(root, files)
-    root.mainloop()
+    app = PickerApp(root, files, index)
+    if index is None:
+        app.scan_after_paint(wall_dir)
+    try:
+        root.mainloop()
+    finally:
+        shutdown_decode_pool()
+    return 0
+
+
+def cmd_warm(args) -> int:
+    # Fill the thumbnail cache and the duplicate/colour features for the
+    # whole library so the GUI starts warm, plus monitor variants of recent
+    # and favourite wallpapers with PRERENDER=1; meant for a systemd timer
+    index, files = _load_index()
+    if not files:
+        return 0
+    features = FeatureIndex(index.root)
+    features.prune(files)
+    need = set(features.missing(files, index))
+    THUMB_ATLAS.prune(files)
+    # A capped atlas only gets the start of the grid; filling it with the
+    # whole library would leave it holding the bottom rows
+    need_raw = set(THUMB_ATLAS.missing(files[:THUMB_ATLAS.capacity()], index))
+    done = failed = 0
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    t0 = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=ctx) as pool:
+        futures = [pool.submit(_warm_one, p, THUMB_SIZE, p in need,
+                               p in need_raw)
+                   for p in files]
+        for p, fut in zip(files, futures):
+            ok, feat, raw = fut.result()
+            if ok:
+                done += 1
+            else:
+                failed += 1
+            if feat is not None:
+                features.put(p, index.info(p), feat)
+            if raw is not None:
+                THUMB_ATLAS.put(p, THUMB_SIZE,
+                                Image.frombytes("RGB", THUMB_SIZE, raw))
+        monitors = get_monitors() if PRERENDER else []
+        if monitors:
+            for fut in [pool.submit(prerender_variants, [p], monitors)
+                        for p in prerender_wanted()]:
+                fut.result()
+    features.save()
+    THUMB_ATLAS.save()
+    THUMB_DISK_CACHE.prune()
+    if not args.quiet:
+        print(f"warmed {done} thumbnails ({failed} failed) "
+              f"in {time.perf_counter() - t0:.1f}s")
+    return 1 if failed and not done else 0
+
+
+def cmd_set(args) -> int:
+    path = Path(args.path).expanduser()
+    if not path.is_file():
+        print(f"No such file: {path}", file=sys.stderr)
+        return 1
+    ok, err = set_wallpaper(path)
+    if not ok:
+        print(err, file=sys.stderr)
+    return 0 if ok else 1
+
+
+def cmd_random(args) -> int:
+    # Picks from the index instead of re-listing WALL_DIR, skipping the last
+    # --no-repeat wallpapers (the history, plus LAST_FILE)
+    index, files = _load_index()
+    if args.animated or args.static:
+        files = [p for p in files
+                 if bool((index.info(p) or [0, 0, 0, 0, False])[4]) == args.animated]
+    if not files:
+        print("No matching images", file=sys.stderr)
+        return 1
+    recent = set(recent_wallpapers()[:args.no_repeat])
+    try:
+        recent.add(Path(Path(LAST_FILE).read_text().strip()))
+    except OSError:
+        pass
+    import random
+
+    choices = [p for p in files if p not in recent] or files
+    path = random.choice(choices)
+    ok, err = set_wallpaper(path)
+    if not ok:
+        print(err, file=sys.stderr)
+        return 1
+    if not args.quiet:
+        print(path)
+    return 0
+
+
+def cmd_stats(args) -> int:
+    index, files = _load_index()
+    recs = [index.info(p) for p in files]
+    recs = [r for r in recs if r]
+    animated = sum(1 for r in recs if r[4])
+    total = sum(r[0] for r in recs)
+
+    def dir_size(root: Path) -> tuple[int, int]:
+        n = size = 0
+        for p in root.rglob("*"):
+            try:
+                if p.is_file():
+                    n += 1
+                    size += p.stat().st_size
+            except OSError:
+                pass
+        return n, size
+
+    cache = Path(CACHE_DIR).expanduser()
+    thumbs = dir_size(cache / "thumbs")
+    variants = dir_size(cache / "variants")
+    res: dict[str, int] = defaultdict(int)
+    for r in recs:
+        res[f"{r[2]}x{r[3]}"] += 1
+    features = FeatureIndex(index.root)
+    known = len(files) - len(features.missing(files, index))
+    dups = duplicate_groups(files, features, index, DUP_DISTANCE)
+    groups = len(set(dups.values()))
+    print(f"library     {index.root}")
+    print(f"index       {index.path}")
+    print(f"images      {len(files)} ({animated} animated, "
+          f"{len(files) - animated} static)")
+    print(f"size        {total / 1e6:.1f} MB")
+    print(f"thumbnails  {thumbs[0]} files, {thumbs[1] / 1e6:.1f} MB "
+          f"(limit {THUMB_CACHE_MB} MB)")
+    print(f"variants    {variants[0]} files, {variants[1] / 1e6:.1f} MB "
+          f"(limit {VARIANT_CACHE_MB} MB)")
+    atlas = THUMB_ATLAS.stats()
+    limit = f"limit {ATLAS_MB} MB" if ATLAS_MB else "unbounded"
+    print(f"atlas       {atlas['entries']} thumbnails, {atlas['bytes'] / 1e6:.1f} MB, "
+          f"{atlas['holes']} holes ({limit})")
+    print(f"features    {known} of {len(files)} ({features.algo})")
+    print(f"duplicates  {len(dups) - groups} in {groups} groups "
+          f"(distance <= {DUP_DISTANCE})")
+    service = SERVICE.request("stats")
+    if service is None:
+        print("service     not running")
+    else:
+        print(f"service     pid {service['pid']}, {service['entries']} buffers, "
+              f"{service['bytes'] / 1e6:.1f} MB (limit {SHARED_CACHE_MB} MB)")
+    print("top resolutions")
+    for r, n in sorted(res.items(), key=lambda kv: -kv[1])[:5]:
+        print(f"  {r:>11}  {n}")
+    return 0
+
+
+def cmd_prerender(args) -> int:
+    # Also spawned detached by set_wallpaper for missing monitor variants
+    prerender_variants([Path(p).expanduser() for p in args.paths])
+    return 0
+
+
+def cmd_serve(args) -> int:
+    # The service decodes for everyone else, never through itself
+    SERVICE.enabled = False
+    import socket
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(CACHE_SOCKET)
+        print(f"Already serving on {CACHE_SOCKET}", file=sys.stderr)
+        return 1
+    except OSError:
+        # Nothing listening: a leftover socket file from a killed service
+        Path(CACHE_SOCKET).unlink(missing_ok=True)
+    finally:
+        probe.close()
+    import signal
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    for d in (Path(CACHE_SOCKET).parent, Path(SHARED_DIR)):
+        d.mkdir(parents=True, exist_ok=True, mode=0o700)
+        if not _private_dir(str(d)):
+            print(f"{d} is not a private directory of this user",
+                  file=sys.stderr)
+            return 1
+    service = CacheService(Path(WALL_DIR).expanduser())
+    if not args.quiet:
+        print(f"serving {len(service.files)} images on {CACHE_SOCKET}")
+    try:
+        service.serve_forever(CACHE_SOCKET)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        Path(CACHE_SOCKET).unlink(missing_ok=True)
+        shutdown_decode_pool()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Wallpaper picker for swww")
+    sub = ap.add_subparsers(dest="cmd")
+    sub.add_parser("gui", help="open the picker (default)").set_defaults(fn=cmd_gui)
+
+    p = sub.add_parser("warm", help="pre-generate thumbnail caches")
+    p.add_argument("-j", "--jobs", type=int, default=DECODE_PROCS)
+    p.add_argument("-q", "--quiet", action="store_true")
+    p.set_defaults(fn=cmd_warm)
+
+    p = sub.add_parser("set", help="set a wallpaper")
+    p.add_argument("path")
+    p.set_defaults(fn=cmd_set)
+
+    p = sub.add_parser("random", help="set a random wallpaper")
+    kind = p.add_mutually_exclusive_group()
+    kind.add_argument("--animated", action="store_true")
+    kind.add_argument("--static", action="store_true")
+    p.add_argument("--no-repeat", type=int, default=1, metavar="N",
+                   help="skip the last N wallpapers (default 1)")
+    p.add_argument("-q", "--quiet", action="store_true")
+    p.set_defaults(fn=cmd_random)
+
+    sub.add_parser("stats", help="print library and cache statistics").set_defaults(fn=cmd_stats)
+
+    p = sub.add_parser("serve", help="run the shared cache service")
+    p.add_argument("-q", "--quiet", action="store_true")
+    p.set_defaults(fn=cmd_serve)
+
+    p = sub.add_parser("prerender", help="render monitor variants")
+    p.add_argument("paths", nargs="*")
+    p.set_defaults(fn=cmd_prerender)
+    return ap
+
+
+def main():
+    if len(sys.argv) == 1:
+        # Hotkey path: skip argparse entirely
+        sys.exit(cmd_gui(None))
+    args = build_parser().parse_args()
+    sys.exit(getattr(args, "fn", cmd_gui)(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmarks for picker.py's image pipeline and startup.
+#
+#   python3 picker_bench.py run [--out results.json]
+#                               [--baseline old.json --threshold 0.15]
+#   python3 picker_bench.py decode [--count N] [--size WxH]
+#   python3 picker_bench.py importtime [--runs N] [--picker path/to/picker.py]
+#
+# "run" generates a synthetic corpus (large JPEGs, PNGs with alpha, long and
+# large GIFs, animated WebPs) and times each pipeline stage in its own
+# process, so peak RSS is per stage. The "populate" stage needs a display;
+# without $DISPLAY it starts Xvfb when available and is skipped otherwise.
+# With --baseline, stages whose mean got slower by more than --threshold are
+# reported and the exit status is 1.
+#
+# "decode" compares the old thumbnail path (full decode + copy + resize) with
+# the reduced-decode path used by build_static_thumb_image.
+#
+# "importtime" runs `python -X importtime` on picker.py (as the CLI imports
+# it, and with load_gui() as the GUI does) and reports the median cumulative
+# import time plus the most expensive modules. --picker points it at another
+# copy, e.g. one checked out from an older commit, for before/after numbers.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+# Every cache a run creates lives under one directory, removed on exit
+SCRATCH = tempfile.TemporaryDirectory(prefix="picker-bench-")
+os.environ.setdefault("PICKER_CACHE_DIR", tempfile.mkdtemp(dir=SCRATCH.name))
+
+import picker  # noqa: E402
+from PIL import Image  # noqa: E402
+
+DEFAULT_CORPUS = Path(tempfile.gettempdir()) / "picker-bench-corpus"
+
+
+def _peak_rss_kb() -> int:
+    # VmHWM resets on exec, ru_maxrss on Linux does not
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _noise_rgb(size: tuple[int, int], seed: int) -> Image.Image:
+    # Gradient + noise so the encoders cannot cheat on flat areas
+    base = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40 + seed % 20)
+    return Image.merge("RGB", (base, noise, base.transpose(
+        Image.FLIP_LEFT_RIGHT)))
+
+
+def make_jpegs(out_dir: Path, count: int, size: tuple[int, int]) -> list[Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        p = out_dir / f"large_{i:04d}.jpg"
+        if not p.exists():
+            _noise_rgb(size, i).save(p, "JPEG", quality=90)
+        paths.append(p)
+    return paths
+
+
+def make_alpha_pngs(out_dir: Path, count: int,
+                    size: tuple[int, int]) -> list[Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        p = out_dir / f"alpha_{i:04d}.png"
+        if not p.exists():
+            im = _noise_rgb(size, i).convert("RGBA")
+            im.putalpha(Image.radial_gradient("L").resize(size))
+            im.save(p, "PNG", compress_level=1)
+        paths.append(p)
+    return paths
+
+
+def make_animations(out_dir: Path, count: int, size: tuple[int, int],
+                    frames: int, fmt: str) -> list[Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ext = "gif" if fmt == "GIF" else "webp"
+    paths = []
+    for i in range(count):
+        p = out_dir / f"anim_{size[0]}x{size[1]}_{frames}f_{i:03d}.{ext}"
+        if not p.exists():
+            base = _noise_rgb(size, i)
+            seq = [base.rotate(k * 360 / frames) for k in range(frames)]
+            if fmt == "GIF":
+                seq = [f.quantize(64) for f in seq]
+            seq[0].save(p, fmt, save_all=True, append_images=seq[1:],
+                        duration=40, loop=0)
+        paths.append(p)
+    return paths
+
+
+def make_corpus(root: Path) -> dict[str, list[Path]]:
+    return {
+        "jpeg": make_jpegs(root / "jpeg", 8, (6000, 4000)),
+        "png_alpha": make_alpha_pngs(root / "png", 6, (3840, 2160)),
+        "gif_long": make_animations(root / "gif", 2, (480, 270), 150, "GIF"),
+        "gif_large": make_animations(root / "gif", 2, (1920, 1080), 24, "GIF"),
+        "webp_anim": make_animations(root / "webp", 2, (1280, 720), 40,
+                                     "WEBP"),
+    }
+
+
+def _summary(times: list[float], items: int) -> dict:
+    times = sorted(times)
+    total = sum(times)
+    return {
+        "n": len(times),
+        "mean_ms": 1000 * total / len(times),
+        "p50_ms": 1000 * times[len(times) // 2],
+        "p95_ms": 1000 * times[min(len(times) - 1, int(len(times) * 0.95))],
+        "max_ms": 1000 * times[-1],
+        "throughput_per_s": items / total if total else 0.0,
+    }
+
+
+def _time_each(fn, items) -> list[float]:
+    out = []
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def _fresh_thumb_cache():
+    picker.THUMB_DISK_CACHE = picker.ThumbCache(
+        Path(tempfile.mkdtemp(prefix="thumbs-", dir=SCRATCH.name)),
+        picker.THUMB_CACHE_MB * 1024 * 1024)
+    picker.THUMB_ATLAS = picker.ThumbAtlas(
+        Path(tempfile.mkdtemp(prefix="atlas-", dir=SCRATCH.name)),
+        picker.THUMB_SIZE, picker.ATLAS_MB * 1024 * 1024)
+
+
+# Stages run in a child process each and return a _summary dict
+def stage_find_images(corpus: Path) -> dict:
+    picker.LibraryIndex(corpus).path.unlink(missing_ok=True)
+    cold = _time_each(lambda _: picker.find_images(corpus), [0])
+    warm = _time_each(lambda _: picker.find_images(corpus), range(20))
+    out = _summary(warm, len(warm))
+    out["cold_ms"] = 1000 * cold[0]
+    return out
+
+
+def stage_resize_cover(files: list[Path]) -> dict:
+    images = []
+    for p in files:
+        im = Image.open(p)
+        im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB")
+        images.append(im)
+    times = _time_each(
+        lambda im: picker._resize_cover_16x9(im, picker.THUMB_SIZE), images)
+    return _summary(times, len(times))
+
+
+def stage_static_thumb_cold(files: list[Path]) -> dict:
+    _fresh_thumb_cache()
+    times = _time_each(
+        lambda p: picker.build_static_thumb_image(p, picker.THUMB_SIZE), files)
+    return _summary(times, len(times))
+
+
+def stage_static_thumb_warm(files: list[Path]) -> dict:
+    _fresh_thumb_cache()
+    for p in files:
+        picker.build_static_thumb_image(p, picker.THUMB_SIZE)
+    times = _time_each(
+        lambda p: picker.build_static_thumb_image(p, picker.THUMB_SIZE), files)
+    return _summary(times, len(times))
+
+
+def stage_static_thumb_atlas(files: list[Path]) -> dict:
+    # Warm tiles as the grid gets them: a slice of the mmap'd atlas
+    _fresh_thumb_cache()
+    for p in files:
+        picker.decode_static_thumb(p, picker.THUMB_SIZE)
+    times = _time_each(
+        lambda p: picker.THUMB_ATLAS.get(p, picker.THUMB_SIZE), files)
+    return _summary(times, len(times))
+
+
+def stage_animation_thumb(files: list[Path]) -> dict:
+    times = _time_each(
+        lambda p: picker.load_animation_store(
+            p, picker.THUMB_SIZE, picker.COL_BG), files)
+    return _summary(times, len(times))
+
+
+def stage_animation_preview(files: list[Path]) -> dict:
+    # At the bucketed size a 1600x970 preview box decodes to
+    size = picker.preview_bucket((1600, 970))
+    times = _time_each(
+        lambda p: picker.load_animation_store(
+            p, size, picker.COL_PREVIEW_BG), files)
+    return _summary(times, len(times))
+
+
+def stage_populate(corpus: Path) -> dict:
+    # Time to first paint (window mapped with placeholder tiles) and until
+    # the visible thumbnails are applied, with a cold thumbnail cache
+    picker.load_gui()
+    tk = picker.tk
+
+    _fresh_thumb_cache()
+    files = picker.find_images(corpus)
+    t0 = time.perf_counter()
+    root = tk.Tk()
+    app = picker.PickerApp(root, files)
+    root.update()
+    first_paint = time.perf_counter() - t0
+    deadline = time.monotonic() + 120
+    while (app.thumb_jobs or app.thumb_ready) and time.monotonic() < deadline:
+        root.update()
+        time.sleep(0.002)
+    visible_thumbs = time.perf_counter() - t0
+    app._on_close()
+    out = _summary([first_paint], 1)
+    out["first_paint_ms"] = 1000 * first_paint
+    out["visible_thumbs_ms"] = 1000 * visible_thumbs
+    return out
+
+
+STATIC = ["jpeg", "png_alpha"]
+ANIMATED = ["gif_long", "gif_large", "webp_anim"]
+STAGES = {
+    "find_images": (stage_find_images, None),
+    "resize_cover": (stage_resize_cover, STATIC),
+    "static_thumb_cold": (stage_static_thumb_cold, STATIC),
+    "static_thumb_warm": (stage_static_thumb_warm, STATIC),
+    "static_thumb_atlas": (stage_static_thumb_atlas, STATIC),
+    "animation_thumb": (stage_animation_thumb, ANIMATED),
+    "animation_preview": (stage_animation_preview, ANIMATED),
+    "populate": (stage_populate, None),
+}
+
+
+def run_stage(name: str, corpus: Path) -> dict:
+    fn, groups = STAGES[name]
+    rss_before = _peak_rss_kb()
+    if groups is None:
+        out = fn(corpus)
+    else:
+        files = make_corpus(corpus)
+        out = fn([p for g in groups for p in files[g]])
+    out["peak_rss_kb"] = _peak_rss_kb()
+    out["peak_rss_delta_kb"] = out["peak_rss_kb"] - rss_before
+    return out
+
+
+def _ensure_display():
+    # Returns (ok, reason, xvfb process to terminate or None)
+    if os.environ.get("DISPLAY"):
+        return True, "", None
+    xvfb = shutil.which("Xvfb")
+    if not xvfb:
+        return False, "no $DISPLAY and Xvfb not installed", None
+    display = ":97"
+    proc = subprocess.Popen([xvfb, display, "-screen", "0", "1920x1080x24"],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    time.sleep(0.5)
+    os.environ["DISPLAY"] = display
+    return True, "", proc
+
+
+def bench_run(args) -> dict:
+    corpus = Path(args.corpus)
+    make_corpus(corpus)
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "decode_backend": picker.DECODE_BACKEND,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": {},
+    }
+    xvfb = None
+    for name in args.stages or STAGES:
+        if name == "populate":
+            ok, reason, xvfb = _ensure_display()
+            if not ok:
+                results["stages"][name] = {"skipped": reason}
+                continue
+        proc = subprocess.run(
+            [sys.executable, __file__, "_stage", name, str(corpus)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            tail = proc.stderr.strip().splitlines()[-1:]
+            results["stages"][name] = {"error": tail[0] if tail else "failed"}
+            continue
+        results["stages"][name] = json.loads(proc.stdout)
+    if xvfb is not None:
+        xvfb.terminate()
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for name, cur in current["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old or "mean_ms" not in old or "mean_ms" not in cur:
+            continue
+        ratio = cur["mean_ms"] / max(1e-9, old["mean_ms"])
+        cur["vs_baseline"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{name}: {old['mean_ms']:.1f} ms -> {cur['mean_ms']:.1f} ms "
+                f"(+{100 * (ratio - 1):.0f}%)")
+    return regressions
+
+
+def thumb_legacy(path: Path, size: tuple[int, int]) -> Image.Image:
+    im = Image.open(path)
+    if im.mode not in ("RGB", "RGBA"):
+        im = im.convert("RGB")
+    im = im.copy()
+    src_w, src_h = im.size
+    scale = max(size[0] / src_w, size[1] / src_h)
+    im = im.resize((round(src_w * scale), round(src_h * scale)),
+                   picker.RESAMPLE)
+    left = (im.width - size[0]) // 2
+    top = (im.height - size[1]) // 2
+    return im.crop((left, top, left + size[0], top + size[1]))
+
+
+def thumb_reduced(path: Path, size: tuple[int, int]) -> Image.Image:
+    im = picker._open_reduced(path, size)
+    if im.mode not in ("RGB", "RGBA"):
+        im = im.convert("RGB")
+    return picker._resize_cover_16x9(im, size)
+
+
+VARIANTS = {"legacy": thumb_legacy, "reduced": thumb_reduced}
+
+
+def run_variant(name: str, files: list[Path]) -> dict:
+    fn = VARIANTS[name]
+    rss_before = _peak_rss_kb()
+    times = _time_each(lambda p: fn(p, picker.THUMB_SIZE), files)
+    out = _summary(times, len(times))
+    out["variant"] = name
+    out["peak_rss_kb"] = _peak_rss_kb()
+    out["peak_rss_delta_kb"] = out["peak_rss_kb"] - rss_before
+    return out
+
+
+def bench_decode(args) -> dict:
+    w, h = (int(v) for v in args.size.lower().split("x"))
+    files = make_jpegs(Path(args.corpus) / "jpeg", args.count, (w, h))
+    results = {}
+    for name in VARIANTS:
+        out = subprocess.run(
+            [sys.executable, __file__, "_variant", name, *map(str, files)],
+            check=True, capture_output=True, text=True,
+        )
+        results[name] = json.loads(out.stdout)
+    legacy, reduced = results["legacy"], results["reduced"]
+    results["speedup"] = legacy["mean_ms"] / max(1e-9, reduced["mean_ms"])
+    results["rss_ratio"] = (legacy["peak_rss_delta_kb"]
+                            / max(1, reduced["peak_rss_delta_kb"]))
+    return results
+
+
+IMPORT_TARGETS = {
+    "cli": "import picker",
+    "gui": "import picker; picker.load_gui()",
+}
+
+
+def _importtime(code: str, picker_dir: Path) -> tuple[int, dict[str, int]]:
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=picker_dir, check=True, capture_output=True, text=True,
+    ).stderr
+    # Lines: "import time: self [us] | cumulative | imported package"
+    mods: dict[str, int] = {}
+    total = 0
+    for line in out.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        cumulative = int(parts[1])
+        mods[name] = cumulative
+        if not parts[2].startswith("  "):
+            total += cumulative
+    return total, mods
+
+
+def bench_importtime(args) -> dict:
+    picker_dir = Path(args.picker).resolve().parent
+    results = {"picker": str(Path(args.picker).resolve())}
+    for target, code in IMPORT_TARGETS.items():
+        if target == "gui" and "def load_gui" not in Path(args.picker).read_text():
+            code = "import picker"  # older versions imported tkinter eagerly
+        _importtime(code, picker_dir)  # warm the bytecode cache
+        runs = [_importtime(code, picker_dir) for _ in range(args.runs)]
+        runs.sort(key=lambda r: r[0])
+        total, mods = runs[len(runs) // 2]
+        top = sorted(mods.items(), key=lambda kv: -kv[1])[:args.top]
+        results[target] = {
+            "median_ms": total / 1000,
+            "min_ms": runs[0][0] / 1000,
+            "top_ms": {name: us / 1000 for name, us in top},
+        }
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="picker.py benchmarks")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="per-stage latency, throughput and RSS")
+    r.add_argument("--corpus", default=str(DEFAULT_CORPUS))
+    r.add_argument("--stage", dest="stages", action="append",
+                   choices=sorted(STAGES))
+    r.add_argument("--out", help="also write the JSON results here")
+    r.add_argument("--baseline", help="previous results JSON to compare")
+    r.add_argument("--threshold", type=float, default=0.15,
+                   help="allowed mean slowdown before failing (0.15 = 15%%)")
+    d = sub.add_parser("decode", help="thumbnail decode time and peak RSS")
+    d.add_argument("--count", type=int, default=12)
+    d.add_argument("--size", default="6000x4000")
+    d.add_argument("--corpus", default=str(DEFAULT_CORPUS))
+    t = sub.add_parser("importtime", help="module import cost of picker.py")
+    t.add_argument("--runs", type=int, default=15)
+    t.add_argument("--top", type=int, default=10)
+    t.add_argument("--picker", default=str(Path(__file__).resolve().parent
+                                           / "picker.py"))
+    s = sub.add_parser("_stage")
+    s.add_argument("name", choices=sorted(STAGES))
+    s.add_argument("corpus")
+    v = sub.add_parser("_variant")
+    v.add_argument("name", choices=sorted(VARIANTS))
+    v.add_argument("files", nargs="+")
+    args = ap.parse_args()
+
+    if args.cmd == "_stage":
+        print(json.dumps(run_stage(args.name, Path(args.corpus))))
+    elif args.cmd == "_variant":
+        print(json.dumps(run_variant(args.name, [Path(f) for f in args.files])))
+    elif args.cmd == "decode":
+        print(json.dumps(bench_decode(args), indent=2))
+    elif args.cmd == "importtime":
+        print(json.dumps(bench_importtime(args), indent=2))
+    elif args.cmd == "run":
+        results = bench_run(args)
+        regressions = []
+        if args.baseline:
+            baseline = json.loads(Path(args.baseline).read_text())
+            regressions = compare(results, baseline, args.threshold)
+            results["regressions"] = regressions
+        text = json.dumps(results, indent=2)
+        if args.out:
+            Path(args.out).write_text(text)
+        print(text)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
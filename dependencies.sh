@@ -34,6 +34,7 @@ PACKAGES=(
   wofi
   python-tkinter
   python-pillow
+  python-numpy
 )
 
 echo "Updating System..."